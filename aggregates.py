@@ -0,0 +1,245 @@
+"""Aggregates of the article dataset, computed once per process and shared read-only by all sessions.
+
+The store keeps running tallies (counts, sums and quantile sketches) and derives the frames the tabs
+display from them, so newly ingested articles update the tallies in time proportional to the batch.
+The article frame is not: every batch is concatenated to it, which copies its numeric and categorical
+columns (about 30 ms at 1M rows, the Arrow text columns are only rechunked), and the cross-filter index
+is rebuilt from it on the next filter of a session. Derived frames are replaced, never modified in
+place, and listeners are notified after every update.
+"""
+from math import pi
+
+import numpy as np
+import pandas as pd
+from bokeh.palettes import Category10
+
+from dataset import CSV_FILE, concat_datasets, dataset_version, read_dataset
+from date_index import DateIndex
+from ingest import INGEST_PERIOD, DatasetWatcher, start_ingestion
+from locations import COUNTRY_KEY, STATE_KEY
+from topic_engine import OUTLIER_BINS, SENTIMENT_RANGE, TopicEngine, partition_by_topic
+
+# The known flags of the publication date, city, state and country of an article, one bit each
+DESCRIPTOR_PATTERNS = 16
+
+
+def add_counts(total, delta):
+    return delta if total is None else total.add(delta, fill_value=0)
+
+
+def known_mask(column):
+    # Categorical codes make the 'Unknown' comparison an integer comparison
+    categories = column.cat.categories
+    unknown_code = categories.get_loc('Unknown') if 'Unknown' in categories else -2
+    return column.cat.codes.to_numpy() != unknown_code
+
+
+def descriptor_patterns(data):
+    # Combine the known flags of every column into one bitmask per article
+    bits = data['publication_date'].notna().to_numpy().view(np.uint8).copy()
+    for bit, column in enumerate(['city', 'state', 'country'], start=1):
+        bits |= known_mask(data[column]).view(np.uint8) << np.uint8(bit)
+    return bits
+
+
+def pattern_descriptors(combinations):
+    # Every descriptor from the article counts per bitmask
+    patterns = np.arange(DESCRIPTOR_PATTERNS)
+
+    def with_bits(mask):
+        return combinations[(patterns & mask) != 0].sum()
+
+    return pd.Series(
+        [combinations.sum(), with_bits(0b0001), with_bits(0b1110), with_bits(0b0010), with_bits(0b0100),
+         with_bits(0b1000)],
+        index=['Total Articles', 'Articles with Publication Date', 'Articles with Location', 'Articles with City',
+               'Articles with State', 'Articles with Country'],
+        dtype=np.int64,
+    )
+
+
+def count_descriptors(data):
+    # A single bincount over the bitmasks yields every descriptor
+    return pattern_descriptors(np.bincount(descriptor_patterns(data), minlength=DESCRIPTOR_PATTERNS))
+
+
+def summary_frame(descriptor_counts, topic_counts):
+    # Create a DataFrame to display the descriptors, with one row per topic found in the data
+    topic_counts = topic_counts.sort_index()
+    descriptors = pd.concat([
+        descriptor_counts.iloc[:2],
+        pd.Series(topic_counts.values, index=[f'{topic.capitalize()} related topic' for topic in topic_counts.index]),
+        descriptor_counts.iloc[2:],
+    ]).astype(np.int64)
+
+    # A selection may hold no articles
+    total_articles = max(descriptor_counts['Total Articles'], 1)
+    return pd.DataFrame({
+        'Descriptor': descriptors.index,
+        'Value': descriptors.values,
+        'Percentage': [f'{(articles / total_articles) * 100:.2f}%' for articles in descriptors.values],
+    })
+
+
+def count_keys(column):
+    # Articles per map feature, a bincount over the codes of the resolved keys
+    codes = column.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(column.cat.categories))
+    return pd.Series(counts[counts > 0], index=column.cat.categories[counts > 0].astype(str))
+
+
+def count_states(data):
+    return count_keys(data[STATE_KEY])
+
+
+def count_countries(data):
+    # Articles with a known US state count for the 'United States of America'
+    return count_keys(data[COUNTRY_KEY])
+
+
+def counts_frame(counts, column):
+    counts = counts.astype(np.int64).sort_values(ascending=False, kind="stable")
+    return pd.DataFrame({column: counts.index, 'count': counts.values})
+
+
+def topics_frame(order, counts, sentiment_sums):
+    counts = np.asarray(counts, dtype=np.int64)
+    sentiment_sums = np.asarray(sentiment_sums, dtype=float)
+    topics_data = pd.DataFrame({'topic': order, 'count': counts,
+                                'sentiment': np.divide(sentiment_sums, counts, out=np.full(len(counts), np.nan),
+                                                       where=counts > 0)})
+
+    # Calculate the angles and colors for the pie chart
+    topics_data['angle'] = topics_data['count'] / topics_data['count'].sum() * 2 * pi
+    topics_data['percentage'] = topics_data['count'] / topics_data['count'].sum() * 100
+    topics_data['color'] = [Category10[10][i % 10] for i in range(len(topics_data))]
+
+    return topics_data
+
+
+def box_stats_frame(topics, sketches):
+    # One row of quartiles and IQR outlier bounds per topic
+    quartiles = np.array([sketch.quantiles([0.25, 0.5, 0.75]) for sketch in sketches])
+    box_stats = pd.DataFrame(quartiles.reshape(-1, 3), columns=["q1", "q2", "q3"])
+    box_stats.insert(0, "topic", list(topics))
+
+    iqr = box_stats.q3 - box_stats.q1
+    box_stats["upper"] = box_stats.q3 + 1.5 * iqr
+    box_stats["lower"] = box_stats.q1 - 1.5 * iqr
+
+    return box_stats
+
+
+def outlier_raster_frame(box_stats, sketches):
+    # One row per non-empty bin, the shade grows with the log of the number of outliers in it. The outliers are
+    # counted against the current whiskers, which move as articles are added.
+    outlier_bins = {topic: sketch.outliers(lower, upper)
+                    for topic, lower, upper, sketch in zip(box_stats['topic'], box_stats['lower'], box_stats['upper'],
+                                                           sketches)}
+    edges = np.linspace(SENTIMENT_RANGE[0], SENTIMENT_RANGE[1], OUTLIER_BINS + 1)
+    centers = (edges[:-1] + edges[1:]) / 2
+    topics = [topic for topic in box_stats['topic'] if outlier_bins[topic].any()]
+
+    bins = [np.flatnonzero(outlier_bins[topic]) for topic in topics]
+    counts = np.concatenate([outlier_bins[topic][nonzero] for topic, nonzero in zip(topics, bins)] or [[]])
+    raster = pd.DataFrame({
+        'topic': np.repeat(topics, [len(nonzero) for nonzero in bins]).astype(object),
+        'sentiment_score': np.concatenate([centers[nonzero] for nonzero in bins] or [[]]),
+        'count': counts.astype(np.int64),
+    })
+    raster['alpha'] = 0.2 + 0.8 * np.log1p(raster['count']) / np.log1p(counts.max(initial=1))
+    return raster
+
+
+class AggregateStore:
+    def __init__(self, data, version=None, source=None):
+        self.version = version
+        # The (csv_file, records end) the data was read from, see read_dataset. Worker processes read it again
+        # instead of receiving the rows.
+        self.source = source
+        self.listeners = []
+
+        # Running tallies, every displayed frame is derived from these
+        self.data = None
+        self.descriptor_counts = None
+        self.day_counts = None
+        self.state_totals = None
+        self.country_totals = None
+        self.topics = None
+
+        # One tally per topic, shared by the pie, bar, box and line charts
+        self.topic_engine = TopicEngine()
+        self.topic_tallies = {}
+
+        self.add(data)
+
+    def add(self, batch):
+        # A new frame, the tables, the cross-filter index and the term index see every article
+        self.data = batch if self.data is None else concat_datasets([self.data, batch])
+        partitions = partition_by_topic(batch)
+        self._accumulate(batch, partitions)
+        self._derive()
+
+        for listener in list(self.listeners):
+            listener()
+
+    def close(self):
+        # Called when a newer dataset version replaces the store
+        self.topic_engine.close()
+
+    def _accumulate(self, batch, partitions):
+        self.descriptor_counts = add_counts(self.descriptor_counts, count_descriptors(batch))
+        self.day_counts = add_counts(self.day_counts, batch['publication_day'].value_counts())
+        self.topic_engine.accumulate(self.topic_tallies, partitions)
+
+        self.state_totals = add_counts(self.state_totals, count_states(batch))
+        self.country_totals = add_counts(self.country_totals, count_countries(batch))
+
+    def _derive(self):
+        self.topic_counts = pd.Series({topic: tally.count for topic, tally in self.topic_tallies.items()},
+                                      dtype=np.int64)
+        self.summary = summary_frame(self.descriptor_counts, self.topic_counts)
+        self.occurrences_by_date = self._derive_occurrences_by_date()
+        self.date_index = DateIndex.from_frame(self.occurrences_by_date)
+        self.topics = self._derive_topics()
+        self.box_stats = self._derive_box_stats()
+        self.outlier_raster = self._derive_outlier_raster()
+        self.smoothed_sentiment = self.topic_engine.smoothed_sentiment(self.topic_tallies)
+        self.state_counts = counts_frame(self.state_totals, 'state')
+        self.country_counts = counts_frame(self.country_totals, 'country')
+
+    def _derive_occurrences_by_date(self):
+        # Count the articles per day, filling the days without articles with zero
+        occurrences_by_date = self.day_counts.astype(np.int64).sort_index()
+        date_range = pd.date_range(start=occurrences_by_date.index.min(), end=occurrences_by_date.index.max(),
+                                   freq="D")
+        occurrences_by_date = occurrences_by_date.reindex(date_range, fill_value=0)
+        return occurrences_by_date.rename_axis("publication_date").reset_index(name="count")
+
+    def _derive_topics(self):
+        # Topics keep their position once shown, so the charts can be patched in place
+        known = [] if self.topics is None else self.topics['topic'].tolist()
+        new = self.topic_counts.drop(known).sort_values(ascending=False, kind="stable").index.tolist()
+        order = known + new
+        return topics_frame(order, [self.topic_tallies[topic].count for topic in order],
+                            [self.topic_tallies[topic].sentiment_sum for topic in order])
+
+    def _derive_box_stats(self):
+        return box_stats_frame(list(self.topic_tallies), [tally.sketch for tally in self.topic_tallies.values()])
+
+    def _derive_outlier_raster(self):
+        return outlier_raster_frame(self.box_stats, [tally.sketch for tally in self.topic_tallies.values()])
+
+
+def store_version():
+    # While ingesting, grown dataset files reach the running store instead of starting a new one
+    return "ingesting" if INGEST_PERIOD else dataset_version()
+
+
+def load_aggregates(version):
+    # The version is part of the cache key, a changed dataset gets a fresh store
+    data, end = read_dataset()
+    store = AggregateStore(data, version, (CSV_FILE, end) if end else None)
+    if INGEST_PERIOD:
+        start_ingestion(store, DatasetWatcher(end))
+    return store
@@ -0,0 +1,136 @@
+"""Synthetic datasets shaped like extended_dataset.csv, for benchmarking the dashboard at any size.
+
+    python benchmarks/generate_dataset.py 1M benchmarks/data/1M/extended_dataset.csv
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Topic shares and sentiment (mean, spread) roughly follow the scraped CNN articles
+TOPICS = {
+    "business": (0.26, 0.05, 0.35),
+    "politics": (0.24, -0.10, 0.40),
+    "sport": (0.20, 0.15, 0.35),
+    "entertainment": (0.17, 0.20, 0.30),
+    "tech": (0.13, 0.10, 0.30),
+}
+
+# Locations are stored lowercase, like the scraper writes them; a few states are not US states
+CITIES = ["new york", "washington", "los angeles", "london", "paris", "atlanta", "chicago", "beijing", "berlin",
+          "houston", "miami", "tokyo", "moscow", "sydney", "boston"]
+STATES = ["new york", "district of columbia", "california", "texas", "florida", "georgia", "illinois",
+          "massachusetts", "washington", "ohio", "virginia", "michigan", "ontario", "bavaria", "queensland"]
+COUNTRIES = ["united states", "united kingdom", "france", "china", "germany", "russia", "japan", "australia",
+             "canada", "india", "brazil", "mexico", "italy", "spain", "england"]
+
+# Share of articles without a publication date, city, state or country
+UNKNOWN_SHARES = {"publication_date": 0.20, "city": 0.50, "state": 0.25, "country": 0.30}
+
+FIRST_DAY = pd.Timestamp("2007-01-01")
+LAST_DAY = pd.Timestamp("2023-06-01")
+
+VOCABULARY_SIZE = 20000
+ARTICLE_POOL_SIZE = 5000
+ARTICLE_WORDS = 80
+
+
+def parse_rows(value):
+    # Accepts plain integers and the 10k/1M shorthands used in the reports
+    value = value.strip().lower()
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+
+def format_rows(rows):
+    for suffix, size in (("M", 1_000_000), ("k", 1_000)):
+        if rows >= size and rows % size == 0:
+            return f"{rows // size}{suffix}"
+    return str(rows)
+
+
+def vocabulary_word(index, letters=4):
+    # Letters only, the wordcloud tokenizer drops digits: 0 is 'aaaa', 1 is 'aaab'
+    word = ""
+    for _ in range(letters):
+        index, letter = divmod(index, 26)
+        word = chr(ord("a") + letter) + word
+    return word
+
+
+def article_pool(rng, size=ARTICLE_POOL_SIZE, words=ARTICLE_WORDS):
+    # Zipf-distributed words, so term frequencies look like natural text
+    vocabulary = np.array([vocabulary_word(index) for index in range(VOCABULARY_SIZE)])
+    ranks = np.minimum(rng.zipf(1.3, size=(size, words)), VOCABULARY_SIZE) - 1
+    return np.array([" ".join(vocabulary[row]) for row in ranks], dtype=object)
+
+
+def weighted_choice(rng, values, size, unknown_share):
+    # Popular values first: the weights fall off with the position in the list
+    weights = 1 / np.arange(1, len(values) + 1)
+    chosen = np.asarray(values, dtype=object)[rng.choice(len(values), size=size, p=weights / weights.sum())]
+    chosen[rng.random(size) < unknown_share] = "Unknown"
+    return chosen
+
+
+def publication_dates(rng, size):
+    # More articles in recent years and on weekdays
+    days = (LAST_DAY - FIRST_DAY).days
+    offsets = np.floor(days * np.sqrt(rng.random(size))).astype(np.int64)
+    weekend = ((FIRST_DAY.dayofweek + offsets) % 7) >= 5
+    offsets[weekend & (rng.random(size) < 0.5)] -= 2
+    minutes = rng.integers(0, 24 * 60, size)
+
+    dates = (FIRST_DAY + pd.to_timedelta(np.clip(offsets, 0, days), unit="D")
+             + pd.to_timedelta(minutes, unit="min"))
+    formatted = dates.strftime("%Y-%m-%d %H:%M").to_numpy(dtype=object)
+    formatted[rng.random(size) < UNKNOWN_SHARES["publication_date"]] = "Unknown"
+    return formatted
+
+
+def generate_chunk(rng, start, size, articles):
+    names = list(TOPICS)
+    shares, means, spreads = (np.array(values) for values in zip(*TOPICS.values()))
+    topic_codes = rng.choice(len(names), size=size, p=shares / shares.sum())
+    sentiment = np.clip(rng.normal(means[topic_codes], spreads[topic_codes]), -1, 1).round(4)
+
+    # Every article is unique, like the scraped ones, so no string is shared between rows in memory
+    ids = np.arange(start, start + size)
+    text = articles[rng.integers(0, len(articles), size)]
+    return pd.DataFrame({
+        "id": ids,
+        "article": [f"{article} ({article_id})" for article, article_id in zip(text, ids)],
+        "highlights": [f"{article[:120]} ({article_id})" for article, article_id in zip(text, ids)],
+        "topic": np.array(names, dtype=object)[topic_codes],
+        "sentiment_score": sentiment,
+        "publication_date": publication_dates(rng, size),
+        "city": weighted_choice(rng, CITIES, size, UNKNOWN_SHARES["city"]),
+        "state": weighted_choice(rng, STATES, size, UNKNOWN_SHARES["state"]),
+        "country": weighted_choice(rng, COUNTRIES, size, UNKNOWN_SHARES["country"]),
+    })
+
+
+def generate_dataset(rows, path, seed=0, chunk_size=500_000):
+    # Written chunk by chunk, so 10M rows do not have to fit in memory at once
+    rng = np.random.default_rng(seed)
+    articles = article_pool(rng)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    for start in range(0, rows, chunk_size):
+        chunk = generate_chunk(rng, start, min(chunk_size, rows - start), articles)
+        chunk.to_csv(tmp_path, index=False, mode="w" if start == 0 else "a", header=start == 0)
+    os.replace(tmp_path, path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("rows", type=parse_rows, help="number of articles, e.g. 10k, 100k, 1M or 10M")
+    parser.add_argument("path", help="CSV file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    generate_dataset(arguments.rows, arguments.path, arguments.seed)
+    print(f"{format_rows(arguments.rows)} articles written to {arguments.path}")
@@ -0,0 +1,337 @@
+"""Benchmarks of the dashboard's aggregation and rendering paths on synthetic datasets.
+
+    python benchmarks/run_benchmarks.py --sizes 10k,100k,1M
+    python benchmarks/run_benchmarks.py --sizes 10M --baseline benchmarks/reports/report-1a2b3c4.json
+
+Every dataset size runs in a fresh process, so the recorded peak memory belongs to that size only.
+Another fresh process measures the memory of a server worker starting with the warm dataset cache.
+The JSON report can be compared with an earlier one through --baseline, regressions beyond the
+tolerance are listed and make the command fail.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import runpy
+import statistics
+import subprocess
+import sys
+import time
+from functools import partial
+from importlib import metadata
+
+from generate_dataset import format_rows, generate_dataset, parse_rows
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+DATA_DIR = os.path.join(BENCHMARK_DIR, "data")
+REPORT_DIR = os.path.join(BENCHMARK_DIR, "reports")
+
+DEFAULT_SIZES = "10k,100k,1M,10M"
+PACKAGES = ["numpy", "pandas", "pyarrow", "bokeh", "panel", "folium"]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def memory_mb():
+    # Resident memory split by what server workers can share: the anonymous part is what every
+    # additional worker adds, the file-backed pages of the memory-mapped dataset cache are shared
+    try:
+        with open("/proc/self/smaps_rollup") as file:
+            kilobytes = {name: int(value.split()[0])
+                         for name, value in (line.split(":", 1) for line in file if line.rstrip().endswith("kB"))}
+    except OSError:  # only Linux reports it
+        return None
+    return {
+        "rss": round(kilobytes["Rss"] / 1024, 1),
+        "anonymous": round(kilobytes["Anonymous"] / 1024, 1),
+        "file_backed": round((kilobytes["Rss"] - kilobytes["Anonymous"]) / 1024, 1),
+    }
+
+
+def measure(function, repeat=1):
+    # Wall clock seconds of every call, summarized; the last result is returned with them
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations), result
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    return {
+        "median": statistics.median(durations),
+        "p95": durations[min(len(durations) - 1, round(0.95 * (len(durations) - 1)))],
+        "min": durations[0],
+        "max": durations[-1],
+        "runs": len(durations),
+    }
+
+
+def document_bytes(layout):
+    # Size of the Bokeh document JSON a browser receives when the tab is first shown
+    import panel as pn
+    from bokeh.document import Document
+
+    document = Document()
+    document.add_root(pn.panel(layout).get_root(document))
+    return len(json.dumps(document.to_json(), default=str))
+
+
+def sweep_windows(days, steps):
+    # Slider positions of a user dragging a quarter-length window across the whole range, then
+    # widening it back to the full range
+    width = max(1, days // 4)
+    for step in range(steps):
+        if step < steps // 2:
+            lo = (days - width) * step // max(1, steps // 2 - 1)
+            yield lo, lo + width
+        else:
+            grown = width + (days - width) * (step - steps // 2) // max(1, steps - steps // 2 - 1)
+            yield 0, min(days, grown)
+
+
+def run_slider_sweeps(namespace, steps):
+    import panel as pn
+    from bokeh.models import ColumnDataSource
+    from bokeh.plotting import figure
+
+    from paged_table import PagedTable
+
+    aggregates = namespace["aggregates"]
+    occurrences_by_date = aggregates.occurrences_by_date
+    days = occurrences_by_date["publication_date"].dt.date.tolist()
+
+    # The same widgets the date tab wires up, driven directly instead of through the browser and the
+    # per-frame scheduler
+    date_range = pn.widgets.DateRangeSlider(start=days[0], end=days[-1], value=(days[0], days[-1]))
+    source = ColumnDataSource({column: [] for column in occurrences_by_date})
+    panes = [pn.pane.Markdown() for _ in range(4)]
+    plot = figure()
+    data_table = PagedTable(occurrences_by_date, page_size=20)
+
+    update_data_durations, update_statistics_durations = [], []
+    for lo, hi in sweep_windows(len(days) - 1, steps):
+        date_range.value = (days[lo], days[hi])
+        start = time.perf_counter()
+        namespace["update_data"](namespace["select_dates"](date_range.value), source, *panes, plot, data_table)
+        update_data_durations.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        namespace["update_statistics"](aggregates.date_index.statistics(lo, hi + 1),
+                                       occurrences_by_date.iloc[lo:hi + 1], *panes, data_table)
+        update_statistics_durations.append(time.perf_counter() - start)
+
+    return {"update_data": summarize(update_data_durations),
+            "update_statistics": summarize(update_statistics_durations)}
+
+
+def run_crossfilter_sweeps(namespace, steps):
+    # The engine alone while a day window is dragged across the range, then the selections of a session,
+    # which also refresh the charts of every built tab
+    from crossfilter import CrossFilter
+
+    aggregates = namespace["aggregates"]
+    days = aggregates.occurrences_by_date["publication_date"].tolist()
+    topics = aggregates.topics["topic"].tolist()
+    states = aggregates.state_counts["state"].tolist()
+
+    engine = CrossFilter(aggregates)
+    index_build, _ = measure(lambda: engine.filter("topic", topics[:1]))
+
+    day_filter_durations = []
+    for lo, hi in sweep_windows(len(days) - 1, steps):
+        start = time.perf_counter()
+        engine.filter("day", (days[lo], days[hi]))
+        day_filter_durations.append(time.perf_counter() - start)
+
+    select_durations = []
+    for dimension, selections in [("topic", [topics[:2], topics[:1]]), ("state", [states[:1], states[:2], None]),
+                                  ("day", [None]), ("topic", [None])]:
+        for selection in selections:
+            start = time.perf_counter()
+            namespace["select"](dimension, selection)
+            select_durations.append(time.perf_counter() - start)
+
+    return {"index_build": index_build, "day_filter": summarize(day_filter_durations),
+            "select": summarize(select_durations)}
+
+
+def run_size(label, repeat, sweep_steps):
+    # The dashboard reads extended_dataset.csv from the working directory
+    os.chdir(os.path.join(DATA_DIR, label))
+    sys.path.insert(0, REPO_DIR)
+    import logging
+    logging.getLogger("bokeh").setLevel(logging.ERROR)
+
+    from aggregates import AggregateStore
+    from dataset import CSV_FILE, cache_paths, load_dataset
+
+    result = {"rows": parse_rows(label), "csv_bytes": os.path.getsize(CSV_FILE), "peak_rss_mb": {}}
+    for path in cache_paths(CSV_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+
+    result["load_dataset_cold"], data = measure(load_dataset)
+    result["peak_rss_mb"]["load_dataset_cold"] = peak_rss_mb()
+    del data
+    result["load_dataset_warm"], data = measure(load_dataset, repeat)
+    result["aggregate_store"], store = measure(partial(AggregateStore, data), repeat)
+    result["peak_rss_mb"]["aggregate_store"] = peak_rss_mb()
+    del data, store
+
+    # Importing main loads the store and builds the first tab, like a new session does
+    result["main_import"], namespace = measure(lambda: runpy.run_path(os.path.join(REPO_DIR, "main.py"),
+                                                                      run_name="benchmark"))
+    result["peak_rss_mb"]["main_import"] = peak_rss_mb()
+
+    result["tabs"] = {}
+    for name, builder in namespace["TAB_BUILDERS"]:
+        timing, layout = measure(builder, repeat)
+        result["tabs"][name] = {"build": timing, "document_bytes": document_bytes(layout)}
+    result["peak_rss_mb"]["tabs"] = peak_rss_mb()
+
+    result["slider_sweeps"] = run_slider_sweeps(namespace, sweep_steps)
+    result["peak_rss_mb"]["slider_sweeps"] = peak_rss_mb()
+
+    result["crossfilter_sweeps"] = run_crossfilter_sweeps(namespace, sweep_steps)
+    result["peak_rss_mb"]["crossfilter_sweeps"] = peak_rss_mb()
+
+    return result
+
+
+def run_worker_memory(label):
+    # A server worker starting with a warm dataset cache, after its first session and after every tab
+    # was built; measured in a fresh process so nothing of the timed runs is left on its heap
+    os.chdir(os.path.join(DATA_DIR, label))
+    sys.path.insert(0, REPO_DIR)
+    import logging
+    logging.getLogger("bokeh").setLevel(logging.ERROR)
+
+    namespace = runpy.run_path(os.path.join(REPO_DIR, "main.py"), run_name="benchmark")
+    memory = {"first_session": memory_mb()}
+    for _, builder in namespace["TAB_BUILDERS"]:
+        builder()
+    memory["all_tabs"] = memory_mb()
+    return memory
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {
+        "commit": commit,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+    }
+
+
+def flatten(results, prefix=""):
+    # Comparable metrics: the median of every timing, document sizes and memory
+    metrics = {}
+    for key, value in results.items():
+        if isinstance(value, dict) and "median" in value:
+            metrics[f"{prefix}{key} (s)"] = value["median"]
+        elif isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif value is None:
+            continue
+        elif key == "document_bytes" or prefix.endswith("peak_rss_mb.") or ".worker_memory_mb." in f".{prefix}":
+            metrics[f"{prefix}{key}"] = value
+    return metrics
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for label, results in report["results"].items():
+        if label not in baseline["results"]:
+            continue
+        current, previous = flatten(results), flatten(baseline["results"][label])
+        for metric in sorted(current.keys() & previous.keys()):
+            if not previous[metric]:
+                continue
+            ratio = current[metric] / previous[metric]
+            flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+            print(f"{label:>5} {metric:<60} {previous[metric]:>12.4g} -> {current[metric]:>12.4g} "
+                  f"({ratio:.2f}x){flag}")
+            if flag:
+                regressions.append((label, metric, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma separated row counts (default {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per timed builder")
+    parser.add_argument("--sweep-steps", type=int, default=50, help="slider positions per sweep")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="report path (default benchmarks/reports/report-<commit>.json)")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or growth (default 0.2)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--memory-worker", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.worker:
+        print(json.dumps(run_size(arguments.worker, arguments.repeat, arguments.sweep_steps)))
+        return 0
+    if arguments.memory_worker:
+        print(json.dumps(run_worker_memory(arguments.memory_worker)))
+        return 0
+
+    report = {"environment": environment(), "results": {}}
+    for label in (format_rows(parse_rows(size)) for size in arguments.sizes.split(",")):
+        csv_file = os.path.join(DATA_DIR, label, "extended_dataset.csv")
+        if not os.path.exists(csv_file):
+            print(f"Generating {label} articles", file=sys.stderr)
+            generate_dataset(parse_rows(label), csv_file, arguments.seed)
+
+        print(f"Benchmarking {label} articles", file=sys.stderr)
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", label,
+                                 "--repeat", str(arguments.repeat), "--sweep-steps", str(arguments.sweep_steps)],
+                                stdout=subprocess.PIPE, text=True, check=True)
+        report["results"][label] = json.loads(worker.stdout.splitlines()[-1])
+
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), "--memory-worker", label],
+                                stdout=subprocess.PIPE, text=True, check=True)
+        report["results"][label]["worker_memory_mb"] = json.loads(worker.stdout.splitlines()[-1])
+
+    output = arguments.output or os.path.join(REPORT_DIR, f"report-{report['environment']['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {output}", file=sys.stderr)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            regressions = compare(report, json.load(file), arguments.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {arguments.tolerance:.0%}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""Cross-filtering of the charts: a topic, date range, state or country selected in one tab filters the
+charts of every other tab.
+
+It follows Crossfilter. The articles are indexed once per process by every dimension, with the rows sorted by
+key, so the rows of a key are one slice. Each group reduces the rows that pass the filters of every dimension
+but its own to counts and sums per cell, the group of the summary has no dimension and reduces the rows passing
+every filter. A session keeps one byte per row, whose bits mark the dimensions that
+filter the row out. Changing a filter only visits the rows of the keys that entered or left it and adds them
+to, or removes them from, the groups. A step of a dragged date slider therefore costs the rows of the days it
+crossed. Sessions without a filter hold no per-row state and show the shared aggregates. Run
+``python crossfilter.py [steps]`` to compare the incremental updates with a brute-force reduction after
+every one of that many random filter changes of the dataset.
+"""
+import numpy as np
+import pandas as pd
+
+from aggregates import (DESCRIPTOR_PATTERNS, box_stats_frame, count_descriptors, counts_frame, descriptor_patterns,
+                        outlier_raster_frame, pattern_descriptors, summary_frame, topics_frame)
+from date_index import DateIndex
+from locations import COUNTRY_KEY, STATE_KEY
+from topic_engine import SENTIMENT_RANGE, SKETCH_BINS, QuantileSketch, smooth_daily
+
+# One filter bit per dimension
+DIMENSIONS = ["topic", "day", "state", "country"]
+
+_index = None
+
+
+class Dimension:
+    def __init__(self, codes, keys):
+        # Rows without a key get the code len(keys), only an unfiltered dimension lets them pass
+        self.keys = keys
+        dtype = np.int16 if len(keys) < np.iinfo(np.int16).max else np.int32
+        self.codes = np.where(codes < 0, len(keys), codes).astype(dtype)
+
+        # A stable sort of small integers is a radix sort
+        self.order = np.argsort(self.codes, kind="stable").astype(np.int32)
+        self.bounds = np.searchsorted(self.codes[self.order], np.arange(len(keys) + 2))
+
+    def mask(self, selection):
+        # Selected keys, and the rows without a key as the last entry
+        if selection is None:
+            return np.ones(len(self.keys) + 1, dtype=bool)
+        if isinstance(selection, tuple):
+            start, end = (np.datetime64(value, "D").astype(np.int64) for value in selection)
+            selected = (self.keys >= start) & (self.keys <= end)
+        else:
+            selected = np.isin(self.keys, list(selection))
+        return np.append(selected, False)
+
+    def rows(self, keys):
+        # Rows of the masked keys, every run of consecutive keys is one slice of the order
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], keys.view(np.int8), [0]))))
+        return np.concatenate([self.order[self.bounds[lo]:self.bounds[hi]] for lo, hi in zip(edges[::2], edges[1::2])]
+                              or [np.empty(0, dtype=np.int32)])
+
+
+class Group:
+    # Counts, and optionally sums of a value, of the rows in every cell. Rows in no cell have the cell size.
+    def __init__(self, dimension, cells, size, values=None):
+        self.dimension = dimension
+        self.cells = cells
+        self.size = size
+        self.values = values
+
+    def reduce(self, rows):
+        cells = self.cells[rows]
+        counts = np.bincount(cells, minlength=self.size + 1)
+        if self.values is None:
+            return counts, None
+        return counts, np.bincount(cells, weights=self.values[rows], minlength=self.size + 1)
+
+
+def cells(reductions, name, shape):
+    # The counts and sums of a group without the rows outside its cells, shaped e.g. one row per topic
+    counts, sums = reductions[name]
+    return counts[:-1].reshape(shape), None if sums is None else sums[:-1].reshape(shape)
+
+
+class CrossIndex:
+    # Shared read-only by the sessions of the process
+    def __init__(self, data):
+        self.data = data
+
+        topics = data['topic']
+        self.topics = np.asarray(topics.cat.categories.astype(str), dtype=object)
+        days = data['publication_day'].to_numpy().astype("datetime64[D]").astype(np.int64)
+        dated = data['publication_day'].notna().to_numpy()
+        first, last = (days[dated].min(), days[dated].max()) if dated.any() else (0, -1)
+        self.days = np.arange(first, last + 1)
+
+        self.dimensions = {
+            "topic": Dimension(topics.cat.codes.to_numpy(), self.topics),
+            "day": Dimension(np.where(dated, days - first, -1), self.days),
+            "state": Dimension(data[STATE_KEY].cat.codes.to_numpy(),
+                               np.asarray(data[STATE_KEY].cat.categories.astype(str), dtype=object)),
+            "country": Dimension(data[COUNTRY_KEY].cat.codes.to_numpy(),
+                                 np.asarray(data[COUNTRY_KEY].cat.categories.astype(str), dtype=object)),
+        }
+
+        # Per topic, the cells of the sentiment sketch and of the daily sentiment series
+        scores = data['sentiment_score'].to_numpy()
+        valid = ~np.isnan(scores)
+        topic_codes, day_codes = self.dimensions["topic"].codes.astype(np.int32), self.dimensions["day"].codes
+        topic_count, day_count = len(self.topics), len(self.days)
+        edges = np.linspace(SENTIMENT_RANGE[0], SENTIMENT_RANGE[1], SKETCH_BINS + 1)
+        bins = np.clip(np.searchsorted(edges, scores, side="right") - 1, 0, SKETCH_BINS - 1)
+        sketch_cells = np.where(valid & (topic_codes < topic_count), topic_codes * SKETCH_BINS + bins,
+                                topic_count * SKETCH_BINS).astype(np.int32)
+        daily_cells = np.where(valid & dated & (topic_codes < topic_count), topic_codes * day_count + day_codes,
+                               topic_count * day_count).astype(np.int32)
+        weights = np.where(valid, scores, 0)
+        # Per topic, and for the articles without one, the articles of every descriptor bitmask
+        descriptor_cells = (topic_codes * DESCRIPTOR_PATTERNS + descriptor_patterns(data)).astype(np.int32)
+
+        self.groups = {
+            "days": Group("day", day_codes, day_count),
+            "topics": Group("topic", topic_codes, topic_count, weights),
+            "sketches": Group("topic", sketch_cells, topic_count * SKETCH_BINS),
+            "daily": Group("topic", daily_cells, topic_count * day_count, weights),
+            "states": Group("state", self.dimensions["state"].codes, len(self.dimensions["state"].keys)),
+            "countries": Group("country", self.dimensions["country"].codes, len(self.dimensions["country"].keys)),
+            "descriptors": Group(None, descriptor_cells, (topic_count + 1) * DESCRIPTOR_PATTERNS),
+        }
+        self.totals = {name: group.reduce(slice(None)) for name, group in self.groups.items()}
+
+
+def brute_force_reductions(index, filters):
+    # Every group reduced from scratch over the rows passing the filters of every dimension but its own, the
+    # reference the incremental updates are checked against
+    passes = {dimension: index.dimensions[dimension].mask(filters.get(dimension))[index.dimensions[dimension].codes]
+              for dimension in DIMENSIONS}
+    return {name: group.reduce(np.flatnonzero(np.logical_and.reduce(
+                [passes[dimension] for dimension in DIMENSIONS if dimension != group.dimension])))
+            for name, group in index.groups.items()}
+
+
+def shared_index(store):
+    # Built on the first filter of any session, and again after the store ingested new articles
+    global _index
+    if _index is None or _index.data is not store.data:
+        _index = CrossIndex(store.data)
+    return _index
+
+
+class CrossFilter:
+    # The selection of one session. Filters change on the event loop, the derived frames may also be read
+    # off it, e.g. by the date tab's worker, so reductions are replaced instead of updated in place.
+    def __init__(self, store):
+        self.store = store
+        self.available = hasattr(store, "data")  # the browser build has no articles to filter
+        self.filters = {}
+        self.listeners = []
+        self.revision = 0
+        self._derived = {}
+
+        self.index = None
+        self.bits = None
+        self.reductions = None
+        self.selected = None
+
+    def on_change(self, listener, dimension=None):
+        # The charts grouped by a dimension do not change with its own filter, they are not notified of it
+        self.listeners.append((listener, dimension))
+
+    def filter(self, dimension, selection):
+        # selection is a collection of keys, a (start, end) range for days, or None to clear the filter
+        if not self.available:
+            return
+        if selection is not None:
+            selection = tuple(map(pd.Timestamp, selection)) if dimension == "day" else frozenset(selection)
+        previous = self.filters.get(dimension)
+        if selection == previous:
+            return
+
+        if self.bits is None or self.index.data is not self.store.data:
+            self._rebuild()
+        dimension_index = self.index.dimensions[dimension]
+        self._move(dimension, dimension_index.mask(previous), dimension_index.mask(selection))
+        if selection is None:
+            del self.filters[dimension]
+        else:
+            self.filters[dimension] = selection
+
+        if not self.filters:
+            # Without filters the shared aggregates are shown, the per-row state is released
+            self.bits = self.reductions = self.selected = None
+        self.revision += 1
+
+        for listener, own_dimension in list(self.listeners):
+            if own_dimension != dimension:
+                listener()
+
+    def refresh(self):
+        # Called after the store ingested new articles, the filters are applied to the grown dataset
+        if self.filters and self.index.data is not self.store.data:
+            self._rebuild()
+        self.revision += 1
+
+    def _rebuild(self):
+        self.index = shared_index(self.store)
+        self.bits = np.zeros(len(self.index.data), dtype=np.uint8)
+        self.reductions = dict(self.index.totals)
+        self.selected = len(self.index.data)
+        for dimension, selection in self.filters.items():
+            dimension_index = self.index.dimensions[dimension]
+            self._move(dimension, dimension_index.mask(None), dimension_index.mask(selection))
+
+    def _move(self, dimension, previous, selection):
+        # Only the rows of the keys that changed membership are visited
+        rows = self.index.dimensions[dimension].rows(previous != selection)
+        old_bits = self.bits[rows]
+        new_bits = old_bits ^ np.uint8(1 << DIMENSIONS.index(dimension))
+
+        moves = {}
+        for name, group in self.index.groups.items():
+            if group.dimension == dimension:
+                continue
+            if group.dimension not in moves:
+                # Rows passing the filters of every dimension but the group's own, before and after
+                own = 0 if group.dimension is None else 1 << DIMENSIONS.index(group.dimension)
+                others = np.uint8(~own & 0xFF)
+                passed, passes = (old_bits & others) == 0, (new_bits & others) == 0
+                moves[group.dimension] = rows[passes & ~passed], rows[passed & ~passes]
+            entered, left = moves[group.dimension]
+
+            (added_counts, added_sums), (removed_counts, removed_sums) = group.reduce(entered), group.reduce(left)
+            counts, sums = self.reductions[name]
+            self.reductions[name] = (counts + added_counts - removed_counts,
+                                     None if sums is None else sums + added_sums - removed_sums)
+
+        self.selected += np.count_nonzero(new_bits == 0) - np.count_nonzero(old_bits == 0)
+        self.bits[rows] = new_bits
+
+    def _derive(self, name, shared, function):
+        # The shared frame without filters, otherwise derived once per selection. The date tab reads the frames
+        # on a worker, the revision is read before the reductions, so a race can only cause a recomputation.
+        revision = self.revision
+        reductions = self.reductions
+        if reductions is None:
+            return shared()
+        cached = self._derived.get(name)
+        if cached is None or cached[0] != revision:
+            cached = self._derived[name] = (revision, function(reductions))
+        return cached[1]
+
+    @property
+    def article_count(self):
+        selected = self.selected
+        return len(self.store.data) if selected is None else int(selected)
+
+    def keep(self, positions):
+        # The row positions passing every filter, in their order
+        bits = self.bits
+        return positions if bits is None else positions[bits[positions] == 0]
+
+    @property
+    def summary(self):
+        def derive(reductions):
+            counts, _ = cells(reductions, "descriptors", (len(self.index.topics) + 1, DESCRIPTOR_PATTERNS))
+            topic_counts = pd.Series(counts[:-1].sum(axis=1), index=self.index.topics)
+            return summary_frame(pattern_descriptors(counts.sum(axis=0)),
+                                 topic_counts.reindex(self.store.topic_counts.index, fill_value=0))
+
+        return self._derive("summary", lambda: self.store.summary, derive)
+
+    def day_frames(self):
+        # The daily counts and their index, always of the same selection
+        def derive(reductions):
+            counts, _ = cells(reductions, "days", -1)
+            occurrences_by_date = pd.DataFrame({
+                'publication_date': self.index.days.astype("datetime64[D]").astype("datetime64[ns]"),
+                'count': counts.astype(np.int64),
+            })
+            return occurrences_by_date, DateIndex.from_frame(occurrences_by_date)
+
+        return self._derive("days", lambda: (self.store.occurrences_by_date, self.store.date_index), derive)
+
+    def _topic_positions(self, topics):
+        return pd.Index(self.index.topics).get_indexer(topics)
+
+    @property
+    def topics(self):
+        def derive(reductions):
+            # In the order of the shared frame, so the charts keep their factors
+            order = self.store.topics['topic'].tolist()
+            counts, sums = cells(reductions, "topics", -1)
+            positions = self._topic_positions(order)
+            return topics_frame(order, counts[positions], sums[positions])
+
+        return self._derive("topics", lambda: self.store.topics, derive)
+
+    def _sketches(self, reductions):
+        topics = self.store.box_stats['topic'].tolist()
+        counts, _ = cells(reductions, "sketches", (len(self.index.topics), SKETCH_BINS))
+        sketches = []
+        for position in self._topic_positions(topics):
+            sketch = QuantileSketch()
+            sketch.counts = counts[position]
+            sketches.append(sketch)
+        return topics, sketches
+
+    @property
+    def box_stats(self):
+        return self._derive("box_stats", lambda: self.store.box_stats,
+                            lambda reductions: box_stats_frame(*self._sketches(reductions)))
+
+    @property
+    def outlier_raster(self):
+        def derive(reductions):
+            topics, sketches = self._sketches(reductions)
+            return outlier_raster_frame(box_stats_frame(topics, sketches), sketches)
+
+        return self._derive("outlier_raster", lambda: self.store.outlier_raster, derive)
+
+    @property
+    def smoothed_sentiment(self):
+        def derive(reductions):
+            counts, sums = cells(reductions, "daily", (len(self.index.topics), len(self.index.days)))
+            frames = []
+            for topic, position in zip(self.index.topics, range(len(self.index.topics))):
+                dated = counts[position] > 0
+                days = self.index.days[dated]
+                frames.append(smooth_daily(topic, pd.Series(sums[position][dated], index=days),
+                                           pd.Series(counts[position][dated], index=days)))
+            return pd.concat(frames, ignore_index=True).sort_values('publication_date', kind="stable",
+                                                                    ignore_index=True)
+
+        return self._derive("smoothed_sentiment", lambda: self.store.smoothed_sentiment, derive)
+
+    def _key_counts(self, reductions, group, dimension):
+        counts, _ = cells(reductions, group, -1)
+        keys = self.index.dimensions[dimension].keys
+        return counts_frame(pd.Series(counts[counts > 0], index=keys[counts > 0]), dimension)
+
+    @property
+    def state_counts(self):
+        return self._derive("state_counts", lambda: self.store.state_counts,
+                            lambda reductions: self._key_counts(reductions, "states", "state"))
+
+    @property
+    def country_counts(self):
+        return self._derive("country_counts", lambda: self.store.country_counts,
+                            lambda reductions: self._key_counts(reductions, "countries", "country"))
+
+
+def random_selection(rng, dimension, keys):
+    # A random filter of a dimension: cleared, a day range, or a random subset of the keys
+    if rng.random() < 0.2:
+        return None
+    if dimension == "day":
+        lo, hi = np.sort(rng.integers(0, len(keys), 2))
+        return tuple(np.datetime64(int(keys[position]), "D") for position in (lo, hi))
+    return set(rng.choice(keys, size=rng.integers(1, len(keys) + 1), replace=False))
+
+
+def check_incremental(store, steps, seed=0):
+    # Random filter changes, after each the incremental reductions must equal the brute-force ones
+    rng = np.random.default_rng(seed)
+    cross_filter = CrossFilter(store)
+    for step in range(steps):
+        dimension = DIMENSIONS[rng.integers(len(DIMENSIONS))]
+        keys = shared_index(store).dimensions[dimension].keys
+        cross_filter.filter(dimension, random_selection(rng, dimension, keys) if len(keys) else None)
+        if cross_filter.reductions is None:
+            continue
+
+        expected = brute_force_reductions(cross_filter.index, cross_filter.filters)
+        for name, (counts, sums) in cross_filter.reductions.items():
+            expected_counts, expected_sums = expected[name]
+            if not np.array_equal(counts, expected_counts) or (sums is not None and
+                                                               not np.allclose(sums, expected_sums)):
+                raise AssertionError(f"group {name!r} differs after step {step}, filters {cross_filter.filters}")
+        if cross_filter.selected != np.count_nonzero(cross_filter.bits == 0):
+            raise AssertionError(f"selected count differs after step {step}, filters {cross_filter.filters}")
+
+        # The summary reduced per topic and descriptor bitmask against one counted from the selected articles
+        selected = store.data.take(cross_filter.keep(np.arange(len(store.data))))
+        topic_counts = selected['topic'].value_counts().reindex(store.topic_counts.index, fill_value=0)
+        if not cross_filter.summary.equals(summary_frame(count_descriptors(selected), topic_counts)):
+            raise AssertionError(f"summary differs after step {step}, filters {cross_filter.filters}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    from aggregates import AggregateStore
+    from dataset import load_dataset
+
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    store = AggregateStore(load_dataset())
+    check_incremental(store, steps)
+    store.close()
+    print(f"{steps} random filter changes match the brute-force reductions")
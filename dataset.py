@@ -0,0 +1,243 @@
+"""Loading of the article dataset through a typed, memory-mapped columnar cache.
+
+The frame is kept compact, so several server workers can hold it. Topics and locations are
+dictionary-encoded, with the location names title-cased once on their categories, and the locations
+are resolved to the map features once, see locations.py, so the cache also depends on the feature
+names of the GeoJSON files. Sentiment scores are float32. The article text stays in Arrow string
+arrays, which the cache read maps zero-copy, so the workers share those pages instead of each holding
+its own Python strings. Only complete CSV records are loaded, rows appended to the file after the
+last of them are left to the ingestion, see ingest.py.
+"""
+import hashlib
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from locations import KEY_COLUMNS, features_digest, resolve_locations
+
+try:
+    import pyarrow as pa
+    from pyarrow import feather
+except ImportError:  # e.g. the Pyodide build, which has no pyarrow wheel
+    pa = None
+    feather = None
+
+CSV_FILE = "extended_dataset.csv"
+CSV_URL = "https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/main/extended_dataset.csv"
+
+CATEGORICAL_COLUMNS = ["topic", "city", "state", "country"]
+LOCATION_COLUMNS = ["city", "state", "country"]
+TEXT_COLUMNS = ["article", "highlights"]
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+# Without pyarrow the text stays in object columns
+TEXT_DTYPE = "object" if pa is None else pd.StringDtype("pyarrow")
+
+# Bump whenever normalize_dataset or the cache meta changes, so stale caches are rebuilt
+CACHE_VERSION = 5
+CACHE_SUFFIX = ".arrow"
+META_SUFFIX = ".arrow.json"
+
+
+def title_case(column):
+    # Title-case the categories instead of every row, names differing only in case are merged
+    categories = column.cat.categories.astype(str).str.title()
+    names, positions = np.unique(categories, return_inverse=True)
+    codes = column.cat.codes.to_numpy()
+    return pd.Categorical.from_codes(np.where(codes >= 0, positions[codes], -1), names)
+
+
+def normalize_dataset(frame):
+    # Dictionary-encode the low cardinality columns
+    for column in CATEGORICAL_COLUMNS:
+        frame[column] = frame[column].astype("category")
+    for column in LOCATION_COLUMNS:
+        frame[column] = title_case(frame[column])
+    resolve_locations(frame)
+
+    frame["sentiment_score"] = frame["sentiment_score"].astype(np.float32)
+    for column in TEXT_COLUMNS:
+        frame[column] = frame[column].astype(TEXT_DTYPE)
+
+    # Parse the publication dates once, 'Unknown' becomes NaT, and bucket them by day
+    frame["publication_date"] = pd.to_datetime(frame["publication_date"], format=DATE_FORMAT, errors="coerce")
+    frame["publication_day"] = frame["publication_date"].dt.normalize()
+
+    return frame
+
+
+def concat_datasets(frames):
+    # Align the categories first, so the categorical columns survive the concatenation
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in CATEGORICAL_COLUMNS + KEY_COLUMNS:
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.union(frame[column].cat.categories)
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def complete_records_end(chunk, quoted=False):
+    # End of the last complete CSV record, newlines inside quoted fields do not count. Quoted tells whether
+    # the chunk starts inside a quoted field.
+    quotes = chunk.count(b'"') + quoted
+    end = chunk.rfind(b"\n")
+    while end >= 0 and (quotes - chunk.count(b'"', end)) % 2:
+        end = chunk.rfind(b"\n", 0, end)
+    return end + 1
+
+
+def scan_records(path, size, chunk_size=1 << 20):
+    # One pass over the first size bytes: the end of the last complete record and the digest of the bytes
+    digest = hashlib.sha256()
+    end = position = 0
+    quoted = False
+    with open(path, "rb") as file:
+        while position < size:
+            chunk = file.read(min(chunk_size, size - position))
+            if not chunk:
+                break
+            digest.update(chunk)
+            chunk_end = complete_records_end(chunk, quoted)
+            if chunk_end:
+                end = position + chunk_end
+            quoted = (chunk.count(b'"') + quoted) % 2 == 1
+            position += len(chunk)
+    return end, digest.hexdigest()
+
+
+class FilePrefix(io.RawIOBase):
+    # The first size bytes of a file, rows appended while the file is parsed are not read
+    def __init__(self, file, size):
+        self.file = file
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(min(len(buffer), self.remaining))
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def read_records(csv_file, end):
+    with open(csv_file, "rb") as file:
+        return pd.read_csv(io.BufferedReader(FilePrefix(file, end)))
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_paths(csv_file):
+    root, _ = os.path.splitext(csv_file)
+    return root + CACHE_SUFFIX, root + META_SUFFIX
+
+
+def read_cache_meta(meta_file):
+    try:
+        with open(meta_file) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_meta(meta_file, meta):
+    tmp_file = f"{meta_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w") as file:
+        json.dump(meta, file)
+    os.replace(tmp_file, meta_file)
+
+
+def valid_cache_meta(csv_file, cache_file, meta_file):
+    # The meta of the cache when it still holds the records of the CSV file, otherwise None
+    meta = read_cache_meta(meta_file)
+    if meta is None or meta.get("version") != CACHE_VERSION or not os.path.exists(cache_file):
+        return None
+    # The location keys are resolved against the map features, new GeoJSON files need new keys. Without the
+    # files the cached keys are kept, keys left unresolved are resolved once the files are available.
+    features = features_digest()
+    if features is not None and meta.get("features") != features:
+        return None
+
+    stat = os.stat(csv_file)
+    if stat.st_size != meta["size"]:
+        return None
+    if stat.st_mtime_ns == meta["mtime_ns"]:
+        return meta
+
+    # The file was touched, only its content decides whether the cache is stale
+    if file_digest(csv_file) != meta["sha256"]:
+        return None
+    meta = dict(meta, mtime_ns=stat.st_mtime_ns)
+    write_cache_meta(meta_file, meta)
+    return meta
+
+
+def build_cache(csv_file, cache_file, meta_file):
+    # Only the complete records are parsed, a record still being written is left to the ingestion
+    stat = os.stat(csv_file)
+    end, digest = scan_records(csv_file, stat.st_size)
+    frame = normalize_dataset(read_records(csv_file, end))
+
+    # Write uncompressed Arrow IPC so later starts can memory-map it, and
+    # replace atomically so concurrently starting workers never see a partial file
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    feather.write_feather(frame, tmp_file, compression="uncompressed")
+    os.replace(tmp_file, cache_file)
+    write_cache_meta(meta_file, {
+        "version": CACHE_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest,
+        "end": end,
+        "features": features_digest(),
+    })
+
+    return frame, end
+
+
+def read_cache(cache_file):
+    # The memory-mapped pages are shared by every worker reading the same cache, split_blocks keeps
+    # numeric columns and the Arrow string columns zero-copy views onto them
+    table = feather.read_table(cache_file, memory_map=True)
+    return table.to_pandas(split_blocks=True, types_mapper={pa.string(): TEXT_DTYPE}.get)
+
+
+def dataset_version(csv_file=CSV_FILE, csv_url=CSV_URL):
+    # Cheap identity of the dataset a load_dataset call would return
+    if not os.path.exists(csv_file):
+        return csv_url
+    stat = os.stat(csv_file)
+    return f"{csv_file}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def read_dataset(csv_file=CSV_FILE, csv_url=CSV_URL):
+    # The dataset and the end of the CSV records it holds, records appended to the file start there
+    if not os.path.exists(csv_file):
+        return normalize_dataset(pd.read_csv(csv_url)), 0
+    if pa is None:
+        end, _ = scan_records(csv_file, os.path.getsize(csv_file))
+        return normalize_dataset(read_records(csv_file, end)), end
+
+    cache_file, meta_file = cache_paths(csv_file)
+    meta = valid_cache_meta(csv_file, cache_file, meta_file)
+    if meta is not None:
+        return read_cache(cache_file), meta["end"]
+
+    return build_cache(csv_file, cache_file, meta_file)
+
+
+def load_dataset(csv_file=CSV_FILE, csv_url=CSV_URL):
+    return read_dataset(csv_file, csv_url)[0]
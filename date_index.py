@@ -0,0 +1,61 @@
+"""Precomputed index over the daily article counts for constant time window statistics."""
+import numpy as np
+import pandas as pd
+
+
+class DateIndex:
+    def __init__(self, days, counts):
+        # Sorted day array and the article count of each day
+        self.days = np.asarray(days, dtype="datetime64[D]")
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+        # Prefix sums, cumulative[i] is the number of articles before day i
+        self.cumulative = np.concatenate(([0], np.cumsum(self.counts)))
+
+        # Sparse tables holding the position of the minimum/maximum of every
+        # power-of-two long window, level k covers the days [i, i + 2**k)
+        self.argmin_table = self._build_sparse_table(np.less_equal)
+        self.argmax_table = self._build_sparse_table(np.greater_equal)
+
+    @classmethod
+    def from_frame(cls, occurrences_by_date):
+        return cls(occurrences_by_date["publication_date"].to_numpy(), occurrences_by_date["count"].to_numpy())
+
+    def _build_sparse_table(self, prefer_left):
+        levels = [np.arange(len(self.counts))]
+        width = 1
+        while 2 * width <= len(self.counts):
+            previous = levels[-1]
+            left, right = previous[:-width], previous[width:]
+            # On ties keep the earlier day, matching idxmin/idxmax
+            levels.append(np.where(prefer_left(self.counts[left], self.counts[right]), left, right))
+            width *= 2
+        return levels
+
+    def _query(self, table, lo, hi, prefer_left):
+        level = (hi - lo).bit_length() - 1
+        left, right = table[level][lo], table[level][hi - (1 << level)]
+        return left if prefer_left(self.counts[left], self.counts[right]) else right
+
+    def window(self, start, end):
+        # Positions [lo, hi) of the days inside the closed [start, end] range
+        lo = int(np.searchsorted(self.days, np.datetime64(pd.Timestamp(start), "D"), side="left"))
+        hi = int(np.searchsorted(self.days, np.datetime64(pd.Timestamp(end), "D"), side="right"))
+        return lo, hi
+
+    def statistics(self, lo, hi):
+        if lo >= hi:
+            return None
+
+        min_position = self._query(self.argmin_table, lo, hi, np.less_equal)
+        max_position = self._query(self.argmax_table, lo, hi, np.greater_equal)
+        total = int(self.cumulative[hi] - self.cumulative[lo])
+
+        return {
+            "total": total,
+            "min": int(self.counts[min_position]),
+            "min_date": pd.Timestamp(self.days[min_position]),
+            "max": int(self.counts[max_position]),
+            "max_date": pd.Timestamp(self.days[max_position]),
+            "mean": total / (hi - lo),
+        }
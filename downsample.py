@@ -0,0 +1,72 @@
+"""Server-side reduction of chart series to what the viewport can show."""
+import numpy as np
+
+# Roughly two points per horizontal pixel of the widest chart
+MAX_POINTS = 1500
+
+
+def as_float(values):
+    # Datetimes are compared in milliseconds since the epoch, like the Bokeh ranges
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ms]").astype(np.int64).astype(float)
+    return values.astype(float)
+
+
+def minmax_indices(x, y, max_points):
+    # Keep the lowest and highest point of every bucket, so no peak or dip disappears
+    buckets = np.array_split(np.arange(len(y)), max(1, max_points // 2))
+    indices = set()
+    for bucket in buckets:
+        if len(bucket):
+            values = y[bucket]
+            indices.update((bucket[np.argmin(values)], bucket[np.argmax(values)]))
+    return np.sort(np.fromiter(indices, dtype=np.int64))
+
+
+def lttb_indices(x, y, max_points):
+    # Largest-Triangle-Three-Buckets: keep the first and last point and, per bucket, the point
+    # forming the largest triangle with the previous pick and the next bucket's average
+    if max_points < 3 or len(y) <= max_points:
+        return np.arange(len(y))
+
+    edges = np.linspace(1, len(y) - 1, max_points - 1).astype(np.int64)
+    indices = np.empty(max_points, dtype=np.int64)
+    indices[0], indices[-1] = 0, len(y) - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        next_lo, next_hi = hi, edges[bucket + 2] if bucket + 2 < len(edges) else len(y)
+        average_x, average_y = x[next_lo:next_hi].mean(), y[next_lo:next_hi].mean()
+
+        areas = np.abs((x[previous] - average_x) * (y[lo:hi] - y[previous])
+                       - (x[previous] - x[lo:hi]) * (average_y - y[previous]))
+        previous = lo + int(np.argmax(areas))
+        indices[bucket + 1] = previous
+
+    return indices
+
+
+def decimate(frame, x, y, method, x_range=None, max_points=MAX_POINTS):
+    # Rows of the frame inside the visible x range (plus one neighbour on each side, so lines
+    # reach the plot edges), reduced to at most max_points with the given method
+    x_values = as_float(frame[x].to_numpy())
+    lo, hi = 0, len(frame)
+    if x_range is not None:
+        lo = max(int(np.searchsorted(x_values, x_range[0], side="left")) - 1, 0)
+        hi = min(int(np.searchsorted(x_values, x_range[1], side="right")) + 1, len(frame))
+
+    if hi - lo <= max_points:
+        return frame.iloc[lo:hi]
+
+    y_values = as_float(frame[y].to_numpy()[lo:hi])
+    valid = np.flatnonzero(~np.isnan(y_values))
+    selected = method(x_values[lo:hi][valid], y_values[valid], max_points)
+    return frame.iloc[lo + valid[selected]]
+
+
+def raster_counts(values, bins, value_range):
+    # Histogram of dense scatter values, drawn as one shaded cell per non-empty bin
+    positions = np.searchsorted(np.linspace(value_range[0], value_range[1], bins + 1), values, side="right") - 1
+    return np.bincount(np.clip(positions, 0, bins - 1), minlength=bins)
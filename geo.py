@@ -0,0 +1,103 @@
+"""Process-wide store of the GeoJSON assets used by the map tabs.
+
+The files are looked up in the local geodata directory first and only downloaded (and saved
+there) when missing. Run ``python geo.py`` once to vendor them for offline deployments, without
+them the maps are drawn without their features and the article locations stay unresolved.
+"""
+import functools
+import json
+import logging
+import os
+import urllib.request
+
+GEO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geodata")
+
+GEO_ASSETS = {
+    "us-states": "https://raw.githubusercontent.com/python-visualization/folium/main/tests/us-states.json",
+    "world-countries":
+        "https://raw.githubusercontent.com/python-visualization/folium/main/examples/data/world-countries.json",
+}
+
+# Seconds to wait for the asset server, a server without network fails instead of hanging on the first load
+FETCH_TIMEOUT = 30
+
+# Coordinates are rounded to this many decimals (about 100 m) for the maps
+MAP_PRECISION = 3
+
+logger = logging.getLogger(__name__)
+
+
+def asset_path(name):
+    return os.path.join(GEO_DIR, f"{name}.json")
+
+
+def fetch_asset(name):
+    path = asset_path(name)
+    with urllib.request.urlopen(GEO_ASSETS[name], timeout=FETCH_TIMEOUT) as response:
+        content = response.read()
+
+    os.makedirs(GEO_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def simplify_ring(ring, precision):
+    # Round the coordinates and drop the points that collapse onto their predecessor
+    simplified = []
+    for point in ring:
+        point = [round(coordinate, precision) for coordinate in point]
+        if not simplified or point != simplified[-1]:
+            simplified.append(point)
+
+    # Keep every ring a valid, closed polygon
+    if len(simplified) < 4:
+        return [[round(coordinate, precision) for coordinate in point] for point in ring]
+    return simplified
+
+
+def simplify_geometry(geometry, precision):
+    if geometry["type"] == "Polygon":
+        coordinates = [simplify_ring(ring, precision) for ring in geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        coordinates = [[simplify_ring(ring, precision) for ring in polygon] for polygon in geometry["coordinates"]]
+    else:
+        return geometry
+    return dict(geometry, coordinates=coordinates)
+
+
+@functools.lru_cache(maxsize=None)
+def load_geojson(name, precision=None):
+    # Loaded once per process, callers that hand the result to folium must copy it
+    if precision is not None:
+        geojson = load_geojson(name)
+        return dict(geojson, features=[dict(feature, geometry=simplify_geometry(feature["geometry"], precision))
+                                       for feature in geojson["features"]])
+
+    if not os.path.exists(asset_path(name)):
+        fetch_asset(name)
+    with open(asset_path(name)) as file:
+        return json.load(file)
+
+
+@functools.lru_cache(maxsize=None)
+def is_available(name):
+    # A failed download is not retried in this process, every caller would wait for it again
+    try:
+        load_geojson(name)
+    except (OSError, ValueError) as error:
+        logger.warning("The %s GeoJSON file can neither be read nor downloaded: %s", name, error)
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def feature_names(name):
+    return frozenset(feature["properties"]["name"] for feature in load_geojson(name)["features"])
+
+
+if __name__ == "__main__":
+    for asset in GEO_ASSETS:
+        fetch_asset(asset)
+        print(f"{asset}: {len(feature_names(asset))} features saved to {asset_path(asset)}")
@@ -0,0 +1,205 @@
+"""Incremental ingestion of newly scraped articles and delta updates of the chart sources.
+
+Set DASHBOARD_INGEST_PERIOD (e.g. '30s') to watch for new articles while the server runs. Rows
+appended to the dataset CSV and CSV batch files dropped into DASHBOARD_DROP_DIR (default 'incoming')
+are added to the shared aggregate store. Batch files should be written elsewhere and moved into
+the directory, so they are never read half-written.
+"""
+import glob
+import io
+import logging
+import os
+import tempfile
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import panel as pn
+from bokeh.models import ColumnDataSource
+
+from dataset import CSV_FILE, complete_records_end, normalize_dataset, read_dataset
+from instrumentation import record_push
+
+INGEST_PERIOD = os.environ.get("DASHBOARD_INGEST_PERIOD")
+DROP_DIR = os.environ.get("DASHBOARD_DROP_DIR", "incoming")
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetWatcher:
+    def __init__(self, offset, csv_file=CSV_FILE, drop_dir=DROP_DIR):
+        self.csv_file = csv_file
+        self.drop_dir = drop_dir
+        self.ingested_files = set()
+
+        # The end of the records the dataset was loaded from, see read_dataset, everything after it is new
+        self.offset = offset
+        self.columns = pd.read_csv(csv_file, nrows=0).columns.tolist() if os.path.exists(csv_file) else None
+
+    def read_tail(self):
+        if self.columns is None:
+            return None
+
+        size = os.path.getsize(self.csv_file)
+        if size < self.offset:
+            logger.warning("%s was truncated, restart the server to reload it", self.csv_file)
+            self.offset = size
+        if size <= self.offset:
+            return None
+
+        with open(self.csv_file, "rb") as file:
+            file.seek(self.offset)
+            chunk = file.read(size - self.offset)
+
+        # A record that is still being written is picked up by the next poll
+        end = complete_records_end(chunk)
+        if end == 0:
+            return None
+        self.offset += end
+
+        return pd.read_csv(io.BytesIO(chunk[:end]), header=None, names=self.columns)
+
+    def read_drop_dir(self):
+        frames = []
+        for path in sorted(glob.glob(os.path.join(self.drop_dir, "*.csv"))):
+            if path not in self.ingested_files:
+                frames.append(pd.read_csv(path))
+                self.ingested_files.add(path)
+        return frames
+
+    def poll(self):
+        frames = [frame for frame in [self.read_tail(), *self.read_drop_dir()] if frame is not None and len(frame)]
+        if not frames:
+            return None
+        return normalize_dataset(pd.concat(frames, ignore_index=True))
+
+
+def ingest(store, watcher):
+    batch = watcher.poll()
+    if batch is not None:
+        store.add(batch)
+        logger.info("Ingested %d new articles", len(batch))
+
+
+def start_ingestion(store, watcher, period=INGEST_PERIOD):
+    # Runs on the server event loop, once per process and dataset version
+    pn.state.schedule_task(f"ingest-{store.version}", partial(ingest, store, watcher), period=period)
+
+
+def update_source(source, frame, key=None):
+    # Send only the delta when the frame extends what the source already holds: changed values
+    # are patched and new rows streamed, anything else replaces the data. Without a key the
+    # row positions identify the rows.
+    current = source.data
+    length = len(next(iter(current.values()), []))
+    columns = list(frame.columns)
+
+    extends = 0 < length <= len(frame) and sorted(current) == sorted(columns)
+    if extends and key is not None:
+        extends = np.array_equal(np.asarray(current[key]), frame[key].to_numpy()[:length])
+    if not extends:
+        # Copied, patches modify the arrays in place and the frame may be shared by every session
+        source.data = {column: frame[column].to_numpy(copy=True) for column in columns}
+        record_push("ColumnDataSource", source.data, len(frame))
+        return
+
+    patches = {}
+    for column in columns:
+        old, new = pd.Series(np.asarray(current[column])), frame[column].iloc[:length].reset_index(drop=True)
+        changed = np.flatnonzero(~(old.eq(new) | (old.isna() & new.isna())).to_numpy())
+        if len(changed):
+            values = new.to_numpy()[changed]
+            if values.dtype.kind == "M":
+                # As datetime objects, which Bokeh sends as milliseconds since the epoch and which keep the
+                # datetime64 arrays of the source intact, integers would be stored there as nanoseconds
+                values = values.astype("datetime64[ms]")
+            patches[column] = list(zip(changed.tolist(), values.tolist()))
+    if patches:
+        source.patch(patches)
+        record_push("ColumnDataSource", {column: [value for _, value in patch] for column, patch in patches.items()},
+                    max(len(patch) for patch in patches.values()))
+
+    if len(frame) > length:
+        new_rows = {column: frame[column].to_numpy()[length:] for column in columns}
+        source.stream(new_rows)
+        record_push("ColumnDataSource", new_rows, len(frame) - length)
+
+
+def frame_source(frame):
+    # A new source holding the frame, its columns as arrays
+    source = ColumnDataSource({column: [] for column in frame.columns})
+    update_source(source, frame)
+    return source
+
+
+def unchanged(old, new):
+    old, new = pd.Series(np.asarray(old)), pd.Series(np.asarray(new))
+    return len(old) == len(new) and bool((old.eq(new) | (old.isna() & new.isna())).all())
+
+
+def check_ingestion(csv_file=CSV_FILE, rows=2000, appended=100):
+    # Appends records to a copy of the first rows of the dataset while it is loaded and ingested, each
+    # record must arrive exactly once. One appended record has a quoted newline and is written in parts.
+    records = pd.read_csv(csv_file, nrows=rows + appended)
+    records.loc[rows + 1, "article"] = 'A "quoted"\nnewline'
+    appended_records = [records.iloc[[position]].to_csv(header=False, index=False).encode()
+                        for position in range(rows, len(records))]
+    tail = b"".join(appended_records)
+    first_cut = len(appended_records[0]) // 2
+    second_cut = len(tail) - len(appended_records[-1]) // 2
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "dataset.csv")
+        records.iloc[:rows].to_csv(path, index=False)
+
+        # The loader must stop before a record that is still being written
+        with open(path, "ab") as file:
+            file.write(tail[:first_cut])
+        data, end = read_dataset(path)
+        if len(data) != rows:
+            raise AssertionError(f"loaded {len(data)} rows instead of the {rows} complete records")
+
+        # Records appended after the load are only read by the watcher, from where the loader stopped
+        with open(path, "ab") as file:
+            file.write(tail[first_cut:second_cut])
+        watcher = DatasetWatcher(end, path, drop_dir=os.path.join(directory, "incoming"))
+        batches = [watcher.poll()]
+        with open(path, "ab") as file:
+            file.write(tail[second_cut:])
+        batches += [watcher.poll(), watcher.poll()]
+        if batches[-1] is not None:
+            raise AssertionError("a poll without new records returned rows")
+
+        ingested = pd.concat([data, *batches[:-1]], ignore_index=True)
+        if not unchanged(ingested["article"].astype(object), records["article"]):
+            raise AssertionError(f"{len(ingested)} rows loaded and ingested differ from the {len(records)} records")
+
+        # A restart loads every record, once from the rebuilt cache and once from the cache it reads
+        for _ in range(2):
+            reloaded, end = read_dataset(path)
+            if len(reloaded) != len(records) or end != os.path.getsize(path):
+                raise AssertionError(f"reloaded {len(reloaded)} rows up to byte {end} of {os.path.getsize(path)}")
+
+    return ingested
+
+
+def check_update_source(frame, rows=100):
+    # The source must hold the frame after patches, streamed rows and replacements, datetimes included
+    frame = frame[["publication_date", "sentiment_score", "topic"]].head(rows).reset_index(drop=True)
+    changed = frame.copy()
+    changed.loc[[3, 10], "publication_date"] = [pd.Timestamp("2001-02-03 04:05"), pd.NaT]
+    changed.loc[[3, 20], "sentiment_score"] = [0.5, np.nan]
+
+    source = frame_source(frame.iloc[:rows // 2])
+    for update, key in [(frame, None), (changed, None), (changed.iloc[:rows // 4], None), (changed, "topic"),
+                        (frame.iloc[::-1].reset_index(drop=True), "publication_date")]:
+        update_source(source, update, key)
+        for column in update.columns:
+            if not unchanged(source.data[column], update[column]):
+                raise AssertionError(f"column {column!r} of the source differs after an update with key {key!r}")
+
+
+if __name__ == "__main__":
+    ingested = check_ingestion()
+    check_update_source(ingested)
+    print(f"{len(ingested)} records loaded and ingested once each, the sources follow their frames")
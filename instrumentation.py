@@ -0,0 +1,221 @@
+"""Latency, row and payload metrics of the tab builders and callbacks, served in the Prometheus text format.
+
+Serve them next to the app on /metrics with:
+
+    panel serve main.py --setup instrumentation.py
+
+With DASHBOARD_PROFILING set, opening the app with ?profile=1 samples the stacks of the server thread
+while that session is open. They are written in the folded format flamegraph.pl and speedscope read
+to DASHBOARD_PROFILE_DIR (default 'profiles') when the session ends.
+"""
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+METRICS_ROUTE = r"/metrics"
+
+# Seconds, from a cheap slider update to a cold CSV load
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROFILING = bool(os.environ.get("DASHBOARD_PROFILING"))
+PROFILE_DIR = os.environ.get("DASHBOARD_PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL = 0.005
+
+logger = logging.getLogger(__name__)
+
+# Name of the instrumented call that is running, rows and payloads are attributed to it
+current_call = contextvars.ContextVar("current_call", default="other")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = Counter()
+        self.rows = Counter()
+        self.pushed_rows = Counter()
+        self.pushed_bytes = Counter()
+
+    def observe(self, name, seconds, failed):
+        with self.lock:
+            self.latencies.setdefault(name, Histogram()).observe(seconds)
+            if failed:
+                self.errors[name] += 1
+
+    def add_rows(self, name, rows):
+        with self.lock:
+            self.rows[name] += rows
+
+    def add_push(self, name, target, rows, size):
+        with self.lock:
+            self.pushed_rows[name, target] += rows
+            self.pushed_bytes[name, target] += size
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ["# HELP dashboard_call_seconds Latency of the tab builders and callbacks.",
+                      "# TYPE dashboard_call_seconds histogram"]
+            for name, histogram in sorted(self.latencies.items()):
+                cumulative = 0
+                for bound, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f'dashboard_call_seconds_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'dashboard_call_seconds_sum{{name="{name}"}} {histogram.sum}')
+                lines.append(f'dashboard_call_seconds_count{{name="{name}"}} {cumulative}')
+
+            for metric, description, counter in [
+                ("dashboard_call_errors_total", "Calls that raised an exception.", self.errors),
+                ("dashboard_rows_processed_total", "Dataset rows the calls aggregated or filtered.", self.rows),
+            ]:
+                lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+                lines += [f'{metric}{{name="{name}"}} {value}' for name, value in sorted(counter.items())]
+
+            for metric, description, counter in [
+                ("dashboard_pushed_rows_total", "Rows sent to ColumnDataSource and DataFrame models.",
+                 self.pushed_rows),
+                ("dashboard_pushed_bytes_total", "Approximate bytes sent to ColumnDataSource and DataFrame models.",
+                 self.pushed_bytes),
+            ]:
+                lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+                lines += [f'{metric}{{name="{name}",target="{target}"}} {value}'
+                          for (name, target), value in sorted(counter.items())]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def instrumented(function):
+    # Records the latency of every call, and attributes the rows and payloads recorded during it
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = current_call.set(name)
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            REGISTRY.observe(name, time.perf_counter() - start, failed)
+            current_call.reset(token)
+
+    return wrapper
+
+
+def record_rows(rows):
+    REGISTRY.add_rows(current_call.get(), int(rows))
+
+
+def payload_bytes(values):
+    # Object columns are estimated from their string lengths, the rest from the array size
+    values = np.asarray(values)
+    if values.dtype == object:
+        return sum(len(str(value)) for value in values)
+    return values.nbytes
+
+
+def record_push(target, columns, rows):
+    # columns maps column names to the values sent, e.g. a frame, a source data dict or patch values
+    size = sum(payload_bytes(columns[column]) for column in columns)
+    REGISTRY.add_push(current_call.get(), target, int(rows), int(size))
+
+
+def register_routes():
+    # Panel registers its own top-level handlers the same way, they must be added before the server starts.
+    # Imported here, the browser build has no tornado.
+    from bokeh.server.urls import toplevel_patterns
+    from tornado.web import RequestHandler
+
+    class MetricsHandler(RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(REGISTRY.render())
+
+    if all(pattern[0] != METRICS_ROUTE for pattern in toplevel_patterns):
+        toplevel_patterns.append((METRICS_ROUTE, MetricsHandler))
+
+
+def folded_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    # Counts the stacks of one thread at a fixed interval, from a daemon thread
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[folded_stack(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def profile_session(doc, session_args):
+    # The server thread runs every session, samples taken while another session is busy include its work
+    if not PROFILING or doc is None or session_args.get("profile") != [b"1"]:
+        return
+
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+
+    def dump(session_context):
+        sampler.stop()
+        path = os.path.join(PROFILE_DIR, f"session-{session_context.id}.folded")
+        sampler.dump(path)
+        logger.info("Wrote %d stack samples to %s", sum(sampler.stacks.values()), path)
+
+    doc.on_session_destroyed(dump)
+
+
+if __name__ == "panel_setup_module":
+    # Run by `panel serve --setup`: the app imports this module normally, so the route is registered on
+    # that module to serve the registry the app records into
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from instrumentation import register_routes as register_app_routes
+
+    register_app_routes()
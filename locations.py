@@ -0,0 +1,190 @@
+"""Resolution of the article locations to the features of the map GeoJSON files.
+
+Every distinct (city, state, country) combination is resolved once, case-insensitively and through a
+table of common aliases, to a US state and a country feature name. The results are stored as
+categorical columns whose categories are all feature names, so their codes mean the same in every
+batch and counting the articles per feature is a bincount over them. Without the GeoJSON files there
+are no features and every key is missing. Run ``python locations.py`` to list the location names that
+match no feature.
+"""
+import hashlib
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from geo import feature_names, is_available
+
+STATE_KEY = "state_key"
+COUNTRY_KEY = "country_key"
+KEY_COLUMNS = [STATE_KEY, COUNTRY_KEY]
+MAP_ASSETS = ['us-states', 'world-countries']
+
+UNITED_STATES = "United States of America"
+
+# Names as they appear in the data, mapped to the feature names of the folium GeoJSON files
+STATE_ALIASES = {
+    "Washington DC": "District of Columbia",
+    "Washington D.C.": "District of Columbia",
+    "DC": "District of Columbia",
+    "D.C.": "District of Columbia",
+}
+COUNTRY_ALIASES = {
+    "United States": UNITED_STATES,
+    "USA": UNITED_STATES,
+    "US": UNITED_STATES,
+    "U.S.": UNITED_STATES,
+    "U.S.A.": UNITED_STATES,
+    "America": UNITED_STATES,
+    "UK": "United Kingdom",
+    "U.K.": "United Kingdom",
+    "Britain": "United Kingdom",
+    "Great Britain": "United Kingdom",
+    "England": "United Kingdom",
+    "Scotland": "United Kingdom",
+    "Wales": "United Kingdom",
+    "Northern Ireland": "United Kingdom",
+    "Russian Federation": "Russia",
+    "Korea": "South Korea",
+    "Republic of Korea": "South Korea",
+    "Serbia": "Republic of Serbia",
+    "Tanzania": "United Republic of Tanzania",
+    "DRC": "Democratic Republic of the Congo",
+    "DR Congo": "Democratic Republic of the Congo",
+    "Congo-Kinshasa": "Democratic Republic of the Congo",
+    "Congo-Brazzaville": "Republic of the Congo",
+    "Cote d'Ivoire": "Ivory Coast",
+    "Bahamas": "The Bahamas",
+    "Czechia": "Czech Republic",
+    "North Macedonia": "Macedonia",
+    "Timor-Leste": "East Timor",
+    "Guinea-Bissau": "Guinea Bissau",
+    "Burma": "Myanmar",
+    "UAE": "United Arab Emirates",
+    "Eswatini": "Swaziland",
+}
+# Large US cities whose name alone gives the state, used when the state of an article is unknown.
+# 'Washington' is left out, it is also a state.
+CITY_STATES = {
+    "New York": "New York",
+    "New York City": "New York",
+    "Washington DC": "District of Columbia",
+    "Washington D.C.": "District of Columbia",
+    "Los Angeles": "California",
+    "San Francisco": "California",
+    "Chicago": "Illinois",
+    "Houston": "Texas",
+    "Dallas": "Texas",
+    "Miami": "Florida",
+    "Atlanta": "Georgia",
+    "Boston": "Massachusetts",
+    "Philadelphia": "Pennsylvania",
+    "Seattle": "Washington",
+    "Detroit": "Michigan",
+}
+
+logger = logging.getLogger(__name__)
+
+
+def match_key(name):
+    # Case, punctuation and spacing do not distinguish names, 'U.S.' matches 'us'
+    return " ".join(re.sub(r"[\W_]+", " ", str(name).casefold()).split())
+
+
+def features_digest():
+    # Identity of the feature names the keys are resolved against, replaced GeoJSON files invalidate the keys.
+    # None when the files are unavailable.
+    if not all(is_available(asset) for asset in MAP_ASSETS):
+        return None
+    digest = hashlib.sha256()
+    for asset in MAP_ASSETS:
+        digest.update("\n".join(sorted(feature_names(asset))).encode() + b"\0")
+    return digest.hexdigest()
+
+
+def alias_table(names, aliases):
+    # Aliases of features missing from the GeoJSON file are left out, their names stay unmatched
+    return {match_key(alias): name for alias, name in aliases.items() if name in names}
+
+
+def name_table(names, aliases):
+    return {**alias_table(names, aliases), **{match_key(name): name for name in names}}
+
+
+class LocationResolver:
+    def __init__(self, state_names, country_names):
+        self.state_names = sorted(state_names)
+        self.country_names = sorted(country_names)
+        self.states = name_table(state_names, STATE_ALIASES)
+        self.cities = alias_table(state_names, CITY_STATES)
+        self.countries = name_table(country_names, COUNTRY_ALIASES)
+
+    @classmethod
+    def from_geojson(cls):
+        if features_digest() is None:
+            return cls([], [])
+        return cls(*[feature_names(asset) for asset in MAP_ASSETS])
+
+    def resolve(self, city, state, country):
+        # A known US state puts the article in the United States, whatever its country says
+        country_name = self.countries.get(match_key(country)) if country is not None else None
+        state_name = self.states.get(match_key(state)) if state is not None else None
+        if state is None and city is not None and country_name in (None, UNITED_STATES):
+            state_name = self.cities.get(match_key(city))
+        if state_name is not None and UNITED_STATES in self.countries.values():
+            country_name = UNITED_STATES
+        return state_name, country_name
+
+    def resolve_frame(self, frame):
+        # Resolve the distinct combinations of the category codes, then spread the results to the rows
+        columns = [frame[column].cat for column in ["city", "state", "country"]]
+        combined = np.zeros(len(frame), dtype=np.int64)
+        for column in columns:
+            combined = combined * (len(column.categories) + 1) + column.codes.to_numpy() + 1
+        inverse, combinations = pd.factorize(combined, sort=False)
+
+        names = []
+        for combination in combinations:
+            values = []
+            for column in reversed(columns):
+                combination, code = divmod(combination, len(column.categories) + 1)
+                values.append(None if code == 0 or column.categories[code - 1] == 'Unknown'
+                              else column.categories[code - 1])
+            names.append(self.resolve(*reversed(values)))
+
+        states, countries = zip(*names) if names else ((), ())
+        return {
+            STATE_KEY: pd.Categorical(states, categories=self.state_names).take(inverse),
+            COUNTRY_KEY: pd.Categorical(countries, categories=self.country_names).take(inverse),
+        }
+
+    def unmatched(self, frame):
+        # Known state and country names that resolve to no feature, with the number of their articles
+        rows = []
+        for column, key in [("state", STATE_KEY), ("country", COUNTRY_KEY)]:
+            names = frame[column][frame[key].isna() & (frame[column] != 'Unknown') & frame[column].notna()]
+            counts = names.value_counts()
+            rows += [(column, name, count) for name, count in counts[counts > 0].items()]
+        return pd.DataFrame(rows, columns=["column", "name", "articles"])
+
+
+def resolve_locations(frame):
+    # Adds the state and country keys to a frame with categorical location columns
+    resolver = LocationResolver.from_geojson()
+    for column, values in resolver.resolve_frame(frame).items():
+        frame[column] = values
+
+    unmatched = resolver.unmatched(frame)
+    if len(unmatched):
+        logger.info("%d location names match no map feature, run `python locations.py` to list them",
+                    len(unmatched))
+    return frame
+
+
+if __name__ == "__main__":
+    from dataset import load_dataset
+
+    report = LocationResolver.from_geojson().unmatched(load_dataset())
+    with pd.option_context("display.max_rows", None):
+        print(report.sort_values(["column", "articles"], ascending=[True, False]).to_string(index=False))
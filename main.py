@@ -1,91 +1,134 @@
-from math import pi
+import copy
+import json
+import os
+import sys
+import time
+from functools import partial
+from urllib.parse import urljoin
+from urllib.request import urlopen
 
 import panel as pn
 import pandas as pd
+from bokeh.events import RangesUpdate
 from bokeh.models import ColumnDataSource, HoverTool, DatetimeTickFormatter, NumeralTickFormatter, Whisker
 from bokeh.plotting import figure
 from bokeh.palettes import Category10
 from bokeh.transform import cumsum, factor_cmap
 from folium import folium
+from panel.io.model import hold
+from panel.io.state import set_curdoc
 from panel.widgets import CheckButtonGroup
 
+if sys.platform == "emscripten":
+    # The converted browser build (docs/app) holds this script only, snapshot.py exports the modules
+    # it imports next to it, together with the precomputed aggregates
+    import js
+
+    SNAPSHOT_URL = urljoin(str(js.location.href), "snapshot/")
+    with urlopen(SNAPSHOT_URL + "manifest.json") as response:
+        for path in json.load(response)["modules"]:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with urlopen(f"{SNAPSHOT_URL}modules/{path}") as module, open(path, "wb") as file:
+                file.write(module.read())
+    sys.path.insert(0, os.getcwd())
+else:
+    SNAPSHOT_URL = None
+
+from aggregates import OUTLIER_BINS, SENTIMENT_RANGE, load_aggregates, store_version
+from crossfilter import CrossFilter
+from downsample import decimate, lttb_indices, minmax_indices
+from geo import MAP_PRECISION, is_available, load_geojson
+from ingest import frame_source, update_source
+from instrumentation import instrumented, profile_session, record_push, record_rows
+from paged_table import PagedTable
+from snapshot import ArticleTable, SnapshotStore
+from update_scheduler import UpdateScheduler
+from wordclouds import STATIC_TOPICS, WordCloud, load_wordclouds, static_wordcloud
+
+
+def select_dates(value):
+    # Everything the date tab shows for a range of days, computed off the event loop. The window is
+    # located with a binary search instead of masking every day.
+    occurrences_by_date, date_index = cross_filter.day_frames()
+    lo, hi = date_index.window(pd.Timestamp(value[0]), pd.Timestamp(value[1]))
+    filtered_occurrences = occurrences_by_date.iloc[lo:hi]
+    return filtered_occurrences, occurrence_points(filtered_occurrences), date_index.statistics(lo, hi)
+
+
+@instrumented
+def update_data(selection, source, total_occurrences_pane, min_occurrences_pane, max_occurrences_pane,
+                average_occurrences_pane, p, data_table):
+    filtered_occurrences, points, statistics = selection
+    record_rows(len(filtered_occurrences))
+    update_source(source, points, key="publication_date")
+
+    p.x_range.start = filtered_occurrences["publication_date"].iloc[0]
+    p.x_range.end = filtered_occurrences["publication_date"].iloc[-1]
+
+    update_statistics(statistics, filtered_occurrences, total_occurrences_pane, min_occurrences_pane,
+                      max_occurrences_pane, average_occurrences_pane, data_table)
 
-def update_data(event, date_start, date_end, occurrences_by_date, source, total_occurrences_pane,
-                min_occurrences_pane, max_occurrences_pane, average_occurrences_pane, p, data_table):
-    start, end = pd.Timestamp(date_start.value), pd.Timestamp(date_end.value)
 
-    if start > end:
-        date_start.value, date_end.value = date_end.value, date_start.value
-    else:
-        filtered_occurrences = occurrences_by_date[
-            (pd.to_datetime(occurrences_by_date["publication_date"]) >= start) &
-            (pd.to_datetime(occurrences_by_date["publication_date"]) <= end)
-            ]
-        source.data = dict(
-            publication_date=pd.to_datetime(filtered_occurrences["publication_date"]),
-            count=filtered_occurrences["count"]
-        )
+def occurrence_points(filtered_occurrences, x_range=None):
+    # Long windows are reduced to the daily minima and maxima the plot width can show
+    return decimate(filtered_occurrences, "publication_date", "count", minmax_indices, x_range)
 
-        p.x_range.start = filtered_occurrences["publication_date"].min()
-        p.x_range.end = filtered_occurrences["publication_date"].max()
 
-        update_statistics(filtered_occurrences, total_occurrences_pane, min_occurrences_pane,
-                          max_occurrences_pane, average_occurrences_pane, data_table)
+def render_occurrences(source, filtered_occurrences, x_range=None):
+    update_source(source, occurrence_points(filtered_occurrences, x_range), key="publication_date")
 
 
-def update_statistics(filtered_occurrences, total_occurrences_pane, min_occurrences_pane,
+@instrumented
+def update_statistics(statistics, filtered_occurrences, total_occurrences_pane, min_occurrences_pane,
                       max_occurrences_pane, average_occurrences_pane, data_table):
-    total_articles = filtered_occurrences["count"].sum()
-    min_articles = filtered_occurrences["count"].min()
-    min_articles_date = filtered_occurrences.loc[filtered_occurrences["count"].idxmin(), "publication_date"]
-    max_articles = filtered_occurrences["count"].max()
-    max_articles_date = filtered_occurrences.loc[filtered_occurrences["count"].idxmax(), "publication_date"]
-    avg_articles = filtered_occurrences["count"].mean()
-
-    total_occurrences_pane.object = f"**Total Published Articles:** {total_articles}"
-    min_occurrences_pane.object = f"**Minimum Published Articles:** {min_articles} (Date: {min_articles_date})"
-    max_occurrences_pane.object = f"**Maximum Published Articles:** {max_articles} (Date: {max_articles_date})"
-    average_occurrences_pane.object = f"**Average Published Articles:** {avg_articles:.2f}"
-
+    total_occurrences_pane.object = f"**Total Published Articles:** {statistics['total']}"
+    min_occurrences_pane.object = (f"**Minimum Published Articles:** {statistics['min']} "
+                                   f"(Date: {statistics['min_date']:%Y-%m-%d})")
+    max_occurrences_pane.object = (f"**Maximum Published Articles:** {statistics['max']} "
+                                   f"(Date: {statistics['max_date']:%Y-%m-%d})")
+    average_occurrences_pane.object = f"**Average Published Articles:** {statistics['mean']:.2f}"
+
+    record_rows(len(filtered_occurrences))
     data_table.value = filtered_occurrences
 
 
-def create_date_layout():
-    filtered_data = data.copy()
-
-    # Filter out rows with unknown publication dates
-    filtered_data = filtered_data[filtered_data["publication_date"] != "Unknown"]
-
-    # Convert publication_date column in filtered_data to datetime
-    filtered_data["publication_date"] = pd.to_datetime(filtered_data["publication_date"], errors="coerce").dt.date
+def date_filter(date_range):
+    # The full range also includes the articles without a date
+    start, end = date_range.value
+    if (pd.Timestamp(start), pd.Timestamp(end)) == (pd.Timestamp(date_range.start), pd.Timestamp(date_range.end)):
+        return None
+    return start, end
 
-    # Group by publication date and count occurrences
-    occurrences_by_date = filtered_data.groupby("publication_date").size().reset_index(name="count")
 
-    # Create a complete range of dates
-    date_range = pd.date_range(start=filtered_data["publication_date"].min(),
-                               end=filtered_data["publication_date"].max(), freq="D")
+def refresh_date_layout(date_range, scheduler):
+    # Extend the slider to the new days, a range ending at the last day keeps following it
+    occurrences_by_date = aggregates.occurrences_by_date
+    first_date = occurrences_by_date["publication_date"].iloc[0].date()
+    last_date = occurrences_by_date["publication_date"].iloc[-1].date()
+    start, end = date_range.value
+    following = pd.Timestamp(end) == pd.Timestamp(date_range.end)
 
-    # Create a DataFrame with all dates
-    all_dates = pd.DataFrame({"publication_date": date_range})
+    date_range.param.update(start=first_date, end=last_date)
+    if following and pd.Timestamp(end) != pd.Timestamp(last_date):
+        date_range.value = (start, last_date)
+        select("day", date_filter(date_range))
+    else:
+        scheduler.submit(date_range.value)
 
-    # Convert publication_date column in all_dates to date
-    all_dates["publication_date"] = pd.to_datetime(all_dates["publication_date"]).dt.date
 
-    # Merge occurrences_by_date with all_dates using merge
-    occurrences_by_date = all_dates.merge(occurrences_by_date, on="publication_date", how="left")
-    occurrences_by_date["count"] = occurrences_by_date["count"].fillna(0)
+@instrumented
+def create_date_layout():
+    occurrences_by_date, date_index = cross_filter.day_frames()
 
-    date_start = pn.widgets.DateSlider(name='Start Date', start=filtered_data["publication_date"].min(),
-                                       end=filtered_data["publication_date"].max(),
-                                       value=filtered_data["publication_date"].min())
-    date_end = pn.widgets.DateSlider(name='End Date', start=filtered_data["publication_date"].min(),
-                                     end=filtered_data["publication_date"].max(),
-                                     value=filtered_data["publication_date"].max())
+    first_date = occurrences_by_date["publication_date"].iloc[0].date()
+    last_date = occurrences_by_date["publication_date"].iloc[-1].date()
+    date_range = pn.widgets.DateRangeSlider(name='Publication date', start=first_date, end=last_date,
+                                            value=(first_date, last_date))
 
     p = figure(title="Number of Published Articles by Date", x_axis_label='Date',
                y_axis_label='Number of Published Articles', width=800, height=400)
-    source = ColumnDataSource(occurrences_by_date)
+    source = ColumnDataSource({column: [] for column in occurrences_by_date})
+    render_occurrences(source, occurrences_by_date)
     p.line(x='publication_date', y='count', source=source, line_width=2)
     p.xaxis.formatter = DatetimeTickFormatter()
 
@@ -99,19 +142,30 @@ def create_date_layout():
     max_occurrences_pane = pn.pane.Markdown()
     average_occurrences_pane = pn.pane.Markdown()
 
-    date_start.param.watch(lambda event: update_data(event, date_start, date_end, occurrences_by_date, source,
-                                                     total_occurrences_pane, min_occurrences_pane,
-                                                     max_occurrences_pane, average_occurrences_pane, p, data_table),
-                           "value")
-    date_end.param.watch(lambda event: update_data(event, date_start, date_end, occurrences_by_date, source,
-                                                   total_occurrences_pane, min_occurrences_pane,
-                                                   max_occurrences_pane, average_occurrences_pane, p, data_table),
-                         "value")
+    def update(selection):
+        update_data(selection, source, total_occurrences_pane, min_occurrences_pane, max_occurrences_pane,
+                    average_occurrences_pane, p, data_table)
 
-    data_table = pn.widgets.DataFrame(filtered_data, height=600, sortable=True, show_index=False)
+    def zoom(event):
+        # Re-aggregate the visible part of the selected window after every pan or zoom
+        start, end = date_range.value
+        occurrences_by_date, date_index = cross_filter.day_frames()
+        lo, hi = date_index.window(pd.Timestamp(start), pd.Timestamp(end))
+        render_occurrences(source, occurrences_by_date.iloc[lo:hi], (event.x0, event.x1))
 
-    update_statistics(occurrences_by_date, total_occurrences_pane, min_occurrences_pane,
-                      max_occurrences_pane, average_occurrences_pane, data_table)
+    # A dragged slider fires many values, only the latest one of every frame is computed and sent. The other
+    # tabs are filtered once the slider is released.
+    scheduler = UpdateScheduler(session_doc, select_dates, update)
+    date_range.param.watch(lambda event: scheduler.submit(event.new), "value")
+    date_range.param.watch(lambda event: select("day", date_filter(date_range)), "value_throttled")
+    p.on_event(RangesUpdate, zoom)
+    subscribe(lambda: refresh_date_layout(date_range, scheduler), "day")
+
+    data_table = PagedTable(occurrences_by_date, page_size=20)
+
+    update_statistics(date_index.statistics(0, len(occurrences_by_date)), occurrences_by_date,
+                      total_occurrences_pane, min_occurrences_pane, max_occurrences_pane, average_occurrences_pane,
+                      data_table)
 
     chart = pn.pane.Bokeh(p, sizing_mode="stretch_width")
     statistics = pn.Column(
@@ -122,49 +176,52 @@ def create_date_layout():
     )
 
     return pn.Column(
-        pn.Row(date_start, date_end),
+        pn.Row(date_range),
         pn.Row(chart, statistics),
         pn.Row(data_table)
     )
 
 
+@instrumented
 def create_summary_layout():
-    # Calculate the desired descriptors based on the dataset
-    total_articles = len(data)
-    topic_categories = ['business', 'sport', 'tech', 'politics', 'entertainment']
-    articles_per_topic = [data[data['topic'] == topic].shape[0] for topic in topic_categories]
-    articles_with_publication_date = data[data['publication_date'] != 'Unknown'].shape[0]
-    percentage_with_publication_date = (articles_with_publication_date / total_articles) * 100
-
-    # Calculate the count of non-'Unknown' values for city, state, and country columns
-    articles_with_location = data[(data['city'] != 'Unknown') | (data['state'] != 'Unknown')
-                                  | (data['country'] != 'Unknown')].shape[0]
-    articles_with_city = data[data['city'] != 'Unknown'].shape[0]
-    articles_with_state = data[data['state'] != 'Unknown'].shape[0]
-    articles_with_country = data[data['country'] != 'Unknown'].shape[0]
-
-    # Create a DataFrame to display the descriptors
-    summary_data = pd.DataFrame({
-        'Descriptor': ['Total Articles', 'Articles with Publication Date'] +
-                      [f'{topic.capitalize()} related topic' for topic in topic_categories] +
-                      ['Articles with Location', 'Articles with City', 'Articles with State', 'Articles with Country'],
-        'Value': [total_articles, articles_with_publication_date] + articles_per_topic +
-                 [articles_with_location, articles_with_city, articles_with_state, articles_with_country],
-        'Percentage': ['100%', f'{percentage_with_publication_date:.2f}%'] +
-                      [f'{(articles / total_articles) * 100:.2f}%' for articles in articles_per_topic] +
-                      [f'{(articles / total_articles) * 100:.2f}%' for articles in
-                       [articles_with_location, articles_with_city, articles_with_state, articles_with_country]]
-    })
-
-    # Create a DataFrame widget to render the summary data
-    summary_widget = pn.widgets.DataFrame(summary_data, fit_columns=True, show_index=False, height=450)
-
-    # Create a DataFrame widget to display all the data
-    all_data_widget = pn.widgets.DataFrame(data, fit_columns=True, show_index=False)
+    # Create a DataFrame widget to render the summary data, it is filled by refresh_selection
+    summary_widget = pn.widgets.DataFrame(fit_columns=True, show_index=False, height=450, disabled=True)
+
+    # Create a paged table to display all the data, only the visible page is sent to the browser
+    if isinstance(aggregates, SnapshotStore):
+        all_data_widget = ArticleTable(aggregates.articles)
+    else:
+        all_data_widget = PagedTable(aggregates.data, selection=cross_filter)
+
+    # The articles passing the topic, date, state and country filters of the other tabs
+    selection_pane = pn.pane.Markdown(visible=cross_filter.available)
+
+    def refresh_selection():
+        # The summary and the articles table only show the selected articles
+        summary = cross_filter.summary
+        summary_widget.value = summary
+        record_push("DataFrame", summary, len(summary))
+        if not cross_filter.available:
+            return
+
+        all_data_widget.param.trigger("selection")
+        filters = [f"{dimension}: {describe_filter(selection)}"
+                   for dimension, selection in cross_filter.filters.items()]
+        selection_pane.object = (f"**Selected articles:** {cross_filter.article_count} of {len(aggregates.data)}"
+                                 + (f" ({'; '.join(filters)})" if filters else ""))
+
+    def refresh():
+        all_data_widget.value = aggregates.data
+        refresh_selection()
+
+    refresh_selection()
+    follow_store(refresh)
+    cross_filter.on_change(refresh_selection)
 
     # Create the layout for the second tab
     content = pn.Column(
         pn.pane.Markdown("## Summary of Data"),
+        selection_pane,
         summary_widget,
         pn.pane.Markdown("## All Data"),
         all_data_widget
@@ -173,43 +230,50 @@ def create_summary_layout():
     return content
 
 
-def create_line_plot(data):
-    # Filter out rows with 'Unknown' publication dates
-    data = data[data['publication_date'] != 'Unknown']
-
-    # Convert publication dates to date format
-    data['publication_date'] = pd.to_datetime(data['publication_date'], format="%Y-%m-%d %H:%M").dt.date
-
-    # Group the data by topic and publication date, and calculate average sentiment score
-    grouped_data = data.groupby(['topic', 'publication_date'])['sentiment_score'].mean().reset_index()
-
-    # Sort the data by publication date
-    grouped_data = grouped_data.sort_values('publication_date')
-
+@instrumented
+def create_line_plot():
     # Create a Bokeh figure for the line plot
     line_plot = figure(height=500, title="Average Sentiment Score Over Time", x_axis_type='datetime',
                        toolbar_location=None, sizing_mode='stretch_width')
 
-    # Create a new column for smoothed sentiment scores
-    grouped_data['smoothed_sentiment'] = grouped_data.groupby('topic')['sentiment_score']. \
-        rolling(window=100, center=True).mean().reset_index(0, drop=True)
-
-    # Get unique topics
-    topics = grouped_data['topic'].unique()
-
     # Color palette for the lines
-    color_palette = Category10[max(3, len(topics))]
-
-    # Add a line glyph for each topic to the line plot
-    lines = []
-    for i, topic in enumerate(topics):
-        topic_data = grouped_data[grouped_data['topic'] == topic]
-        line_data = ColumnDataSource(topic_data)  # Create ColumnDataSource for the selected topic data
+    color_palette = Category10[10]
 
-        line = line_plot.line(x='publication_date', y='smoothed_sentiment', source=line_data,
-                              line_color=color_palette[i],
-                              legend_label=topic, line_width=2, alpha=0.8)
-        lines.append(line)
+    # Create CheckboxGroup for topic selection
+    topic_selection = CheckButtonGroup()
+
+    # Add a line glyph for each topic to the line plot, the sources only receive deltas afterwards
+    lines = {}
+    view = {"x_range": None}
+
+    def refresh():
+        smoothed_sentiment = cross_filter.smoothed_sentiment[['topic', 'publication_date', 'sentiment_score',
+                                                             'smoothed_sentiment']]
+        for topic in set(lines) - set(smoothed_sentiment['topic']):
+            # No article of the topic is selected
+            update_source(lines[topic].data_source, smoothed_sentiment.iloc[:0, 1:])
+
+        for topic, topic_data in smoothed_sentiment.groupby('topic', sort=False):
+            # Long series are reduced with LTTB to the points that shape the visible part of the line
+            topic_data = decimate(topic_data[['publication_date', 'sentiment_score', 'smoothed_sentiment']],
+                                  'publication_date', 'smoothed_sentiment', lttb_indices, view["x_range"])
+            if topic in lines:
+                update_source(lines[topic].data_source, topic_data, key='publication_date')
+                continue
+
+            lines[topic] = line_plot.line(x='publication_date', y='smoothed_sentiment', source=frame_source(topic_data),
+                                          line_color=color_palette[len(lines) % 10],
+                                          legend_label=topic, line_width=2, alpha=0.8)
+            topic_selection.param.update(options=topic_selection.options + [topic],
+                                         value=topic_selection.value + [topic])
+
+    def zoom(event):
+        view["x_range"] = (event.x0, event.x1)
+        refresh()
+
+    refresh()
+    subscribe(refresh, "topic")
+    line_plot.on_event(RangesUpdate, zoom)
 
     # Set up plot properties
     line_plot.xaxis.axis_label = 'Publication Date'
@@ -218,14 +282,12 @@ def create_line_plot(data):
     line_plot.legend.location = 'top_left'
     line_plot.yaxis.formatter = NumeralTickFormatter(format="0.00")  # Format y-axis ticks as two decimal places
 
-    # Create CheckboxGroup for topic selection
-    topic_selection = CheckButtonGroup(options=topics.tolist(),
-                                       value=topics.tolist())
-
-    # Create a callback function to toggle the visibility of lines based on the selected topics
+    # Create a callback function to toggle the visibility of lines based on the selected topics, the other
+    # tabs only count the articles of these topics
     def update_lines(event, param):
-        for i, (line, topic) in enumerate(zip(lines, topics)):
+        for topic, line in lines.items():
             line.visible = topic in param
+        select("topic", None if set(param) == set(topic_selection.options) else param)
 
     # Use the watch function to update the plot when the selection changes
     topic_selection.param.watch(lambda event: update_lines(event, topic_selection.value), 'value')
@@ -236,20 +298,14 @@ def create_line_plot(data):
     return layout
 
 
-def create_box_plot(data):
-    qs = data.groupby("topic")['sentiment_score'].quantile([0.25, 0.5, 0.75])
-    qs = qs.unstack().reset_index()
-    qs.columns = ["topic", "q1", "q2", "q3"]
-    data = pd.merge(data, qs, on="topic", how="left")
+@instrumented
+def create_box_plot():
+    box_stats = cross_filter.box_stats
+    source = frame_source(box_stats)
+    outlier_source = frame_source(cross_filter.outlier_raster)
+    topics = box_stats.topic.tolist()
 
-    # Calculate IQR outlier bounds
-    iqr = data.q3 - data.q1
-    data["upper"] = data.q3 + 1.5 * iqr
-    data["lower"] = data.q1 - 1.5 * iqr
-
-    source = ColumnDataSource(data)
-
-    p = figure(x_range=data.topic.unique(), tools="", toolbar_location=None,
+    p = figure(x_range=topics, tools="", toolbar_location=None,
                title="Sentiment Score Distribution by Topic",
                background_fill_color="#eaefef", y_axis_label="Sentiment Score")
 
@@ -259,36 +315,33 @@ def create_box_plot(data):
     p.add_layout(whisker)
 
     # Quantile boxes
-    cmap = factor_cmap("topic", "TolRainbow7", data.topic.unique())
+    cmap = factor_cmap("topic", "TolRainbow7", topics)
     p.vbar("topic", 0.7, "q2", "q3", source=source, color=cmap, line_color="black")
     p.vbar("topic", 0.7, "q1", "q2", source=source, color=cmap, line_color="black")
 
-    # Outliers
-    outliers = data[~data.sentiment_score.between(data.lower, data.upper)]
-    p.scatter("topic", "sentiment_score", source=outliers, size=6, color="black", alpha=0.3)
+    # Outliers, aggregated per sentiment bin so the glyph count does not grow with the dataset
+    bin_height = (SENTIMENT_RANGE[1] - SENTIMENT_RANGE[0]) / OUTLIER_BINS
+    p.rect("topic", "sentiment_score", width=0.3, height=bin_height, source=outlier_source, color="black",
+           fill_alpha="alpha", line_color=None)
 
     p.xgrid.grid_line_color = None
     p.axis.major_label_text_font_size = "14px"
     p.axis.axis_label_text_font_size = "12px"
 
-    return p
-
+    def refresh():
+        p.x_range.factors = cross_filter.box_stats.topic.tolist()
+        update_source(source, cross_filter.box_stats, key="topic")
+        update_source(outlier_source, cross_filter.outlier_raster)
 
-def create_topics_layout():
-    # Calculate the count of articles per topic
-    topic_counts = data['topic'].value_counts()
+    subscribe(refresh, "topic")
 
-    # Calculate the average sentiment score per topic
-    topic_sentiment = data.groupby('topic')['sentiment_score'].mean()
+    return p
 
-    # Create a temporary DataFrame with topics, counts, and average sentiment scores
-    topics_data = pd.DataFrame({'topic': topic_counts.index, 'count': topic_counts.values,
-                                'sentiment': topic_sentiment.values})
 
-    # Calculate the angles and colors for the pie chart
-    topics_data['angle'] = topics_data['count'] / topics_data['count'].sum() * 2 * pi
-    topics_data['percentage'] = topics_data['count'] / topics_data['count'].sum() * 100
-    topics_data['color'] = Category10[len(topics_data)]
+@instrumented
+def create_topics_layout():
+    topics_data = cross_filter.topics
+    source = frame_source(topics_data)
 
     # Create a Bokeh figure for the pie chart
     pie_chart_plot = figure(height=500, title="Pie Chart", toolbar_location=None,
@@ -297,7 +350,7 @@ def create_topics_layout():
     # Create the wedge glyph for the pie chart
     pie_chart_plot.wedge(x=0, y=1, radius=0.4,
                          start_angle=cumsum('angle', include_zero=True), end_angle=cumsum('angle'),
-                         line_color="white", fill_color='color', legend_field='topic', source=topics_data)
+                         line_color="white", fill_color='color', legend_field='topic', source=source)
 
     # Set up the plot properties
     pie_chart_plot.axis.axis_label = None
@@ -305,11 +358,11 @@ def create_topics_layout():
     pie_chart_plot.grid.grid_line_color = None
 
     # Create a Bokeh figure for the bar chart
-    bar_plot = figure(height=500, title="Average Sentiment Score", x_range=topics_data['topic'],
+    bar_plot = figure(height=500, title="Average Sentiment Score", x_range=topics_data['topic'].tolist(),
                       toolbar_location=None, tooltips="@topic: @sentiment{0.00}", sizing_mode='stretch_width')
 
     # Create the bar glyph for the bar chart
-    bar_plot.vbar(x='topic', top='sentiment', width=0.8, color='color', legend_field='topic', source=topics_data)
+    bar_plot.vbar(x='topic', top='sentiment', width=0.8, color='color', legend_field='topic', source=source)
 
     # Set up the plot properties
     bar_plot.xgrid.grid_line_color = None
@@ -317,6 +370,14 @@ def create_topics_layout():
     bar_plot.yaxis.axis_label = 'Average Sentiment Score'
     bar_plot.legend.location = "top_left"
 
+    def refresh():
+        topics_data = cross_filter.topics
+        bar_plot.x_range.factors = topics_data['topic'].tolist()
+        bar_plot.y_range.start = topics_data['sentiment'].min() - 0.1
+        update_source(source, topics_data, key='topic')
+
+    subscribe(refresh, "topic")
+
     # Convert the Bokeh plots to Panel objects
     pie_chart_pane = pn.pane.Bokeh(pie_chart_plot)
     bar_plot_pane = pn.pane.Bokeh(bar_plot)
@@ -324,54 +385,59 @@ def create_topics_layout():
     # Create the layout for the third tab
     content = pn.Column(pn.Row(
         pie_chart_pane,
-        bar_plot_pane, create_box_plot(data)),
-        create_line_plot(data)
+        bar_plot_pane, create_box_plot()),
+        create_line_plot()
     )
 
     return content
 
 
-def create_state_layout():
-    # Filter the data based on the condition
-    filtered_data = data[(data['city'] != 'Unknown') | (data['state'] != 'Unknown') | (data['country'] != 'Unknown')]
-
-    # Select the desired columns
-    filtered_data = filtered_data[['city', 'state', 'country']]
+def create_state_map(state_counts):
+    # Create a folium map centered on the US
+    state_map = folium.Map(location=[48, -102], zoom_start=3)
 
-    # Read the 'us-states.json' file
-    us_states = pd.read_json('https://raw.githubusercontent.com/python-visualization/folium/main/tests/us-states.json')
+    # Create a choropleth map layer using the state counts
+    if is_available('us-states'):
+        state_map.choropleth(
+            geo_data=copy.deepcopy(load_geojson('us-states', MAP_PRECISION)),
+            data=state_counts,
+            columns=['state', 'count'],
+            highlight=True,
+            key_on='feature.properties.name',
+            legend_name='Number of articles published',
+        )
 
-    filtered_data['state'] = filtered_data['state'].str.title()
+    return state_map
 
-    # Filter out rows where the state is not in the 'us-states.json' file
-    filtered_data = filtered_data[
-        filtered_data['state'].isin(us_states['features'].apply(lambda x: x['properties']['name']))]
 
-    # Calculate the count of articles per state
-    state_counts = filtered_data[filtered_data['state'] != 'Unknown']
-    state_counts = state_counts['state'].value_counts().reset_index()
-    state_counts.columns = ['state', 'count']
+@instrumented
+def create_state_layout():
+    state_counts = cross_filter.state_counts
 
     # Create a DataFrame widget to display the filtered data
-    filtered_data_widget = pn.widgets.DataFrame(state_counts, fit_columns=True, show_index=False)
+    filtered_data_widget = pn.widgets.DataFrame(state_counts, fit_columns=True, show_index=False, disabled=True)
+    record_push("DataFrame", state_counts, len(state_counts))
 
-    # Create a folium map centered on the US
-    state_map = folium.Map(location=[48, -102], zoom_start=3)
+    folium_pane = pn.pane.plot.Folium(create_state_map(state_counts), height=400)
 
-    # Create a choropleth map layer using the state counts
-    state_map.choropleth(
-        geo_data='https://raw.githubusercontent.com/python-visualization/folium/main/tests/us-states.json',
-        data=state_counts,
-        columns=['state', 'count'],
-        highlight=True,
-        key_on='feature.properties.name',
-        legend_name='Number of articles published',
-    )
+    # The selected states filter the other tabs
+    state_select = pn.widgets.MultiChoice(name="Filter the other tabs by state",
+                                           options=sorted(aggregates.state_counts['state']),
+                                           visible=cross_filter.available)
+    state_select.param.watch(lambda event: select("state", event.new or None), "value")
 
-    folium_pane = pn.pane.plot.Folium(state_map, height=400)
+    def refresh():
+        state_counts = cross_filter.state_counts
+        state_select.options = sorted(aggregates.state_counts['state'])
+        filtered_data_widget.value = state_counts
+        record_push("DataFrame", state_counts, len(state_counts))
+        folium_pane.object = create_state_map(state_counts)
+
+    subscribe(refresh, "state")
 
     # Create the layout for the tab
     content = pn.Column(
+        state_select,
         folium_pane,
         filtered_data_widget,
     )
@@ -379,52 +445,52 @@ def create_state_layout():
     return content
 
 
-def create_country_layout():
-    # Filter the data based on the condition
-    filtered_data = data[(data['city'] != 'Unknown') | (data['state'] != 'Unknown') | (data['country'] != 'Unknown')]
-
-    # Select the desired columns
-    filtered_data = filtered_data[['city', 'state', 'country']]
-
-    # Read the 'us-states.json' file
-    us_states = pd.read_json('https://raw.githubusercontent.com/python-visualization/folium/main/tests/us-states.json')
+def create_country_map(country_counts):
+    # Create a folium map centered on the US
+    country_map = folium.Map(location=(30, 10), zoom_start=3, tiles="cartodb positron")
 
-    filtered_data['state'] = filtered_data['state'].str.title()
-    filtered_data['country'] = filtered_data['country'].str.title()
+    # Create a choropleth map layer using the state counts
+    if is_available('world-countries'):
+        country_map.choropleth(
+            geo_data=copy.deepcopy(load_geojson('world-countries', MAP_PRECISION)),
+            data=country_counts,
+            columns=['country', 'count'],
+            highlight=True,
+            key_on='feature.properties.name',
+            legend_name='Number of articles published',
+        )
 
-    # Filter out rows where the state is not in the 'us-states.json' file
-    filtered_data = filtered_data[(filtered_data['state'] == 'Unknown') |
-                                  (filtered_data['state'].isin(us_states['features']
-                                                               .apply(lambda x: x['properties']['name'])))]
+    return country_map
 
-    # Replace the country with 'United States of America'
-    filtered_data.loc[filtered_data['state'] != 'Unknown', 'country'] = 'United States of America'
 
-    # Calculate the count of articles per state
-    country_counts = filtered_data[filtered_data['country'] != 'Unknown']
-    country_counts = country_counts['country'].value_counts().reset_index()
-    country_counts.columns = ['country', 'count']
+@instrumented
+def create_country_layout():
+    country_counts = cross_filter.country_counts
 
     # Create a DataFrame widget to display the filtered data
-    filtered_data_widget = pn.widgets.DataFrame(country_counts, fit_columns=True, show_index=False)
+    filtered_data_widget = pn.widgets.DataFrame(country_counts, fit_columns=True, show_index=False, disabled=True)
+    record_push("DataFrame", country_counts, len(country_counts))
 
-    # Create a folium map centered on the US
-    country_map = folium.Map(location=(30, 10), zoom_start=3, tiles="cartodb positron")
+    folium_pane = pn.pane.plot.Folium(create_country_map(country_counts), height=400)
 
-    # Create a choropleth map layer using the state counts
-    country_map.choropleth(
-        geo_data='https://raw.githubusercontent.com/python-visualization/folium/main/examples/data/world-countries.json',
-        data=country_counts,
-        columns=['country', 'count'],
-        highlight=True,
-        key_on='feature.properties.name',
-        legend_name='Number of articles published',
-    )
+    # The selected countries filter the other tabs
+    country_select = pn.widgets.MultiChoice(name="Filter the other tabs by country",
+                                           options=sorted(aggregates.country_counts['country']),
+                                           visible=cross_filter.available)
+    country_select.param.watch(lambda event: select("country", event.new or None), "value")
+
+    def refresh():
+        country_counts = cross_filter.country_counts
+        country_select.options = sorted(aggregates.country_counts['country'])
+        filtered_data_widget.value = country_counts
+        record_push("DataFrame", country_counts, len(country_counts))
+        folium_pane.object = create_country_map(country_counts)
 
-    folium_pane = pn.pane.plot.Folium(country_map, height=400)
+    subscribe(refresh, "country")
 
     # Create the layout for the tab
     content = pn.Column(
+        country_select,
         folium_pane,
         filtered_data_widget,
     )
@@ -432,20 +498,13 @@ def create_country_layout():
     return content
 
 
-def create_wordcloud_layout():
+@instrumented
+def create_static_wordcloud_layout():
     wordcloud_panel = pn.Column()
 
     # Add wordcloud images to the panel
-    wordcloud_urls = [
-        'https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/9173f4f2f1a1a558c5b2d3c2544091a9b974e930/wordclouds/wordcloud_business.png',
-        'https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/9173f4f2f1a1a558c5b2d3c2544091a9b974e930/wordclouds/wordcloud_entertainment.png',
-        'https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/9173f4f2f1a1a558c5b2d3c2544091a9b974e930/wordclouds/wordcloud_politics.png',
-        'https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/9173f4f2f1a1a558c5b2d3c2544091a9b974e930/wordclouds/wordcloud_sport.png',
-        'https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/9173f4f2f1a1a558c5b2d3c2544091a9b974e930/wordclouds/wordcloud_tech.png',
-    ]
-
-    for url in wordcloud_urls:
-        image_pane = pn.pane.PNG(url, width=800, style={'margin': 'auto'})
+    for topic in STATIC_TOPICS:
+        image_pane = pn.pane.PNG(static_wordcloud(topic), width=800, styles={'margin': 'auto'})
         wordcloud_panel.append(image_pane)
     return pn.Column(
         pn.Row(wordcloud_panel),
@@ -453,23 +512,201 @@ def create_wordcloud_layout():
     )
 
 
+@instrumented
+def create_wordcloud_layout():
+    # Without the wordcloud package, or in the browser build, the static images are shown
+    if WordCloud is None or SNAPSHOT_URL is not None:
+        return create_static_wordcloud_layout()
+
+    wordclouds = cached_version("wordclouds", partial(load_wordclouds, source=aggregates.source), aggregates.version)
+    occurrences_by_date = aggregates.occurrences_by_date
+    first_date = occurrences_by_date["publication_date"].iloc[0].date()
+    last_date = occurrences_by_date["publication_date"].iloc[-1].date()
+
+    topic_select = pn.widgets.Select(name="Topic", options=aggregates.topics['topic'].tolist(), width=200,
+                                     sizing_mode="fixed")
+    date_range = pn.widgets.DateRangeSlider(name="Publication date", start=first_date, end=last_date,
+                                            value=(first_date, last_date))
+    image_pane = pn.pane.PNG(None, width=800, styles={'margin': 'auto'})
+    status = pn.pane.Markdown("Rendering the wordcloud...")
+    location_note = pn.pane.Markdown("The terms are only counted per topic and month, the state and country "
+                                     "filters of the other tabs do not apply.", visible=False)
+    followed = {}
+    # Renders finish in any order, only the one of the latest selection is shown
+    rendering = {"generation": 0}
+
+    def follow_selection():
+        # The topic and date filters of the other tabs pick the cloud, it can still be changed here until they
+        # change again. Returns whether the cloud changed.
+        topics, days = cross_filter.filters.get("topic"), cross_filter.filters.get("day")
+        location_note.visible = "state" in cross_filter.filters or "country" in cross_filter.filters
+        if followed.get("selection") == (topics, days):
+            return False
+        followed["selection"] = (topics, days)
+
+        if days is None:
+            date_range.value = (date_range.start, date_range.end)
+        else:
+            date_range.value = (max(days[0].date(), date_range.start), min(days[1].date(), date_range.end))
+        if topics and topic_select.value not in topics:
+            topic_select.value = next(topic for topic in topic_select.options if topic in topics)
+        return True
+
+    async def update(*events):
+        rendering["generation"] += 1
+        generation = rendering["generation"]
+
+        # Whole months are selected, the full range also includes the articles without a date
+        selection = date_filter(date_range)
+        months = None if selection is None else tuple(pd.Timestamp(value).to_period("M").ordinal
+                                                      for value in selection)
+
+        if wordclouds.closed:
+            status.object = "The dataset has changed, reload the page to see its wordclouds."
+            return
+        status.object = "Rendering the wordcloud..."
+        png = await wordclouds.wordcloud(aggregates.data, topic_select.value, months)
+        if generation != rendering["generation"]:
+            return
+        image_pane.object = png
+        image_pane.visible = png is not None
+        status.object = "" if png is not None else "No articles in this selection."
+
+    def refresh():
+        # New articles may bring new topics and days, the selection is kept
+        first_date = aggregates.occurrences_by_date["publication_date"].iloc[0].date()
+        last_date = aggregates.occurrences_by_date["publication_date"].iloc[-1].date()
+        topic_select.options = aggregates.topics['topic'].tolist()
+        date_range.param.update(start=first_date, end=last_date)
+        pn.state.execute(update)
+
+    def follow():
+        # A changed topic is rendered by its watcher
+        topic = topic_select.value
+        if follow_selection() and topic_select.value == topic:
+            pn.state.execute(update)
+
+    follow_selection()
+    topic_select.param.watch(update, "value")
+    date_range.param.watch(update, "value_throttled")
+    follow_store(refresh)
+    cross_filter.on_change(follow)
+    pn.state.execute(update)
+
+    return pn.Column(
+        pn.Row(topic_select, date_range),
+        location_note,
+        status,
+        image_pane,
+        pn.Spacer(height=20)
+    )
+
+
+def describe_filter(selection):
+    if isinstance(selection, tuple):
+        return " to ".join(f"{value:%Y-%m-%d}" for value in selection)
+    return ", ".join(sorted(selection))
+
+
+def select(dimension, selection):
+    # Filter the charts of the other tabs, their updates are sent in one batched change
+    if session_doc is None:
+        cross_filter.filter(dimension, selection)
+        return
+    with hold(session_doc):
+        cross_filter.filter(dimension, selection)
+
+
+def subscribe(listener, dimension=None):
+    # Apply the selection changes made in the other tabs, the charts grouped by dimension ignore its filter
+    cross_filter.on_change(listener, dimension)
+    follow_store(listener)
+
+
+def follow_store(listener):
+    # Apply store updates on this session's document, in one batched change, until the session ends
+    doc = session_doc
+    listeners = aggregates.listeners
+
+    def run():
+        with set_curdoc(doc), hold(doc):
+            listener()
+
+    def deliver():
+        if doc is None:
+            listener()
+        else:
+            doc.add_next_tick_callback(run)
+
+    # The module globals are cleared when the session ends, the cleanup must not look them up
+    listeners.append(deliver)
+    if doc is not None:
+        doc.on_session_destroyed(lambda session_context: listeners.remove(deliver))
+
+
+def cached_version(key, load, version):
+    # One entry per key: the entry of an earlier dataset version is dropped and closed, the sessions still
+    # showing it keep their reference
+    current = (key, ("version", version))
+    for cached_key in [cached_key for cached_key in list(pn.state.cache) if cached_key[:1] == (key,)]:
+        if cached_key != current:
+            value, _ = pn.state.cache.pop(cached_key)
+            value.close()
+    return pn.state.as_cached(key, load, version=version)
+
+
+def build_tab(tabs, index, tab_timings):
+    # Build a tab the first time it is activated and keep it for the rest of the session
+    name, builder = TAB_BUILDERS[index]
+    if name in tab_timings:
+        return
+
+    start = time.perf_counter()
+    tabs[index].append(builder())
+    tab_timings[name] = time.perf_counter() - start
+
+    pn.state.log(f"Built tab {name!r} in {tab_timings[name] * 1000:.1f} ms "
+                 f"({len(tab_timings)}/{len(TAB_BUILDERS)} tabs, {sum(tab_timings.values()) * 1000:.1f} ms total)")
+
+
+def log_first_paint(session_start, tab_timings):
+    pn.state.log(f"First paint after {(time.perf_counter() - session_start) * 1000:.1f} ms "
+                 f"(tab builds {sum(tab_timings.values()) * 1000:.1f} ms)")
+
+
+TAB_BUILDERS = [
+    ("Summary", create_summary_layout),
+    ("Date published", create_date_layout),
+    ("Topics and sentiments", create_topics_layout),
+    ("States", create_state_layout),
+    ("Countries", create_country_layout),
+    ("Wordclouds", create_wordcloud_layout),
+]
+
+session_start = time.perf_counter()
+
 pn.extension(sizing_mode="stretch_width", template="fast")
 
-csv_file = "extended_dataset.csv"
-try:
-    data = pd.read_csv(csv_file)
-except FileNotFoundError:
-    csv_url = "https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/main/extended_dataset.csv"
-    data = pd.read_csv(csv_url)
-
-tabs = pn.Tabs(
-    ("Summary", create_summary_layout()),
-    ("Date published", create_date_layout()),
-    ("Topics and sentiments", create_topics_layout()),
-    ("States", create_state_layout()),
-    ("Countries", create_country_layout()),
-    ("Wordclouds", create_wordcloud_layout()),
-)
+# Computed once per process (and dataset version), every session only binds the results to widgets.
+# The browser build loads them precomputed instead.
+if SNAPSHOT_URL is not None:
+    aggregates = SnapshotStore(SNAPSHOT_URL)
+else:
+    aggregates = cached_version("aggregates", instrumented(load_aggregates), store_version())
+session_doc = pn.state.curdoc
+profile_session(session_doc, pn.state.session_args)
+
+# The topic, date, state and country filters of this session, shared by its tabs. It follows the store
+# before the tabs do.
+cross_filter = CrossFilter(aggregates)
+follow_store(cross_filter.refresh)
+
+# Only the visible tab is built on session start, the others on their first activation
+tab_timings = {}
+tabs = pn.Tabs(*[(name, pn.Column()) for name, _ in TAB_BUILDERS], dynamic=True)
+build_tab(tabs, tabs.active, tab_timings)
+tabs.param.watch(lambda event: build_tab(tabs, event.new, tab_timings), "active")
+pn.state.onload(lambda: log_first_paint(session_start, tab_timings))
 
 # For development purposes
 # if __name__.startswith("bokeh"):
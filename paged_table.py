@@ -0,0 +1,146 @@
+"""Table widget that keeps the frame on the server and only sends the visible page to the browser."""
+import numpy as np
+import pandas as pd
+import panel as pn
+import param
+from panel.viewable import Viewer
+
+from instrumentation import record_push
+
+NO_SORT = "(none)"
+
+# Row positions filtered at a time while looking for the rows of a page
+SCAN_ROWS = 1 << 16
+
+
+class PagedTable(Viewer):
+    value = param.DataFrame(doc="The full frame, it never leaves the server.")
+
+    selection = param.Parameter(default=None, doc="""
+        Selects the rows shown, e.g. a CrossFilter: its keep(positions) filters row positions and its
+        article_count rows pass. All rows when None. Trigger the parameter after the selection changed.""")
+
+    page = param.Integer(default=1, bounds=(1, None))
+
+    page_size = param.Integer(default=25, bounds=(1, None))
+
+    sort_column = param.String(default=NO_SORT)
+
+    descending = param.Boolean(default=False)
+
+    sortable = param.Boolean(default=True, constant=True, doc="Whether the sort controls are shown.")
+
+    def __init__(self, value, **params):
+        super().__init__(value=value, **params)
+        # Sort orders are computed once per column and reused for every page
+        self._orders = {}
+
+        self._previous = pn.widgets.Button(name="◀ Previous", width=110, sizing_mode="fixed")
+        self._next = pn.widgets.Button(name="Next ▶", width=110, sizing_mode="fixed")
+        self._page_input = pn.widgets.IntInput(name="Page", start=1, value=self.page, width=100, sizing_mode="fixed")
+        self._page_info = pn.pane.Markdown()
+        self._sort_select = pn.widgets.Select(name="Sort by", width=200, sizing_mode="fixed")
+        self._descending_toggle = pn.widgets.Checkbox(name="Descending", value=self.descending)
+        self._table = pn.widgets.DataFrame(fit_columns=True, show_index=False, sortable=False)
+
+        self._previous.on_click(lambda event: self._move(-1))
+        self._next.on_click(lambda event: self._move(1))
+        self._page_input.link(self, value="page")
+        self._sort_select.link(self, value="sort_column")
+        self._descending_toggle.link(self, value="descending")
+
+        self._layout = pn.Column(
+            pn.Row(self._sort_select, self._descending_toggle, visible=self.sortable),
+            self._table,
+            pn.Row(self._previous, self._page_input, self._next, self._page_info),
+        )
+        self._reset()
+
+    def __panel__(self):
+        return self._layout
+
+    @property
+    def row_count(self):
+        return len(self.value) if self.selection is None else self.selection.article_count
+
+    @property
+    def page_count(self):
+        return max(1, -(-self.row_count // self.page_size))
+
+    def _move(self, step):
+        self.page = min(max(self.page + step, 1), self.page_count)
+
+    def _order(self):
+        if not self.sortable or self.sort_column == NO_SORT or self.sort_column not in self.value.columns:
+            return None
+
+        if self.sort_column not in self._orders:
+            column = self.value[self.sort_column].reset_index(drop=True)
+            order = column.sort_values(kind="stable", na_position="last").index.to_numpy()
+            self._orders[self.sort_column] = (order, column.notna().sum())
+        order, valid_count = self._orders[self.sort_column]
+
+        # Missing values stay at the end in both directions
+        if self.descending:
+            return np.concatenate((order[:valid_count][::-1], order[valid_count:]))
+        return order
+
+    @param.depends("value", watch=True)
+    def _reset(self):
+        self._orders = {}
+        self._sort_select.options = [NO_SORT] + list(self.value.columns)
+        if self.sort_column not in self._sort_select.options:
+            self.sort_column = NO_SORT
+        self._first_page()
+
+    @param.depends("selection", watch=True)
+    def _first_page(self):
+        if self.page != 1:
+            self.page = 1
+        else:
+            self._render()
+
+    @param.depends("page", "page_size", "sort_column", "descending", watch=True)
+    def _render(self):
+        if self.page > self.page_count:
+            self.page = self.page_count
+            return
+
+        lo, hi = (self.page - 1) * self.page_size, self.page * self.page_size
+
+        rows = self._page_rows(lo, hi)
+        self._table.value = rows
+        record_push("DataFrame", rows, len(rows))
+
+        self._page_input.param.update(value=self.page, end=self.page_count)
+        self._page_info.object = f"Page {self.page} of {self.page_count} ({self.row_count} rows)"
+
+    def _selected(self, order, count):
+        # The first count selected positions, in display order. The positions are filtered block by block, so
+        # the early pages cost their rows rather than the whole frame.
+        blocks, found = [], 0
+        for start in range(0, len(self.value), SCAN_ROWS):
+            stop = min(start + SCAN_ROWS, len(self.value))
+            block = np.arange(start, stop) if order is None else order[start:stop]
+            blocks.append(self.selection.keep(block))
+            found += len(blocks[-1])
+            if found >= count:
+                break
+        return np.concatenate(blocks or [np.empty(0, dtype=np.int64)])[:count]
+
+    def _page_rows(self, lo, hi):
+        # Only the rows of the visible page are materialized and serialized
+        order = self._order()
+        if order is None and self.selection is None:
+            positions = np.arange(lo, min(hi, len(self.value)))
+        else:
+            positions = (order if self.selection is None else self._selected(order, hi))[lo:hi]
+        if not len(positions):
+            return self.value.iloc[:0]
+        if order is None and positions[-1] - positions[0] == len(positions) - 1:
+            # A contiguous slice is a view, also of Arrow-backed text columns
+            return self.value.iloc[positions[0]:positions[-1] + 1]
+
+        # pandas takes rows from chunked Arrow columns by concatenating all their chunks first, the rows
+        # of a sorted or selected page are sliced out one by one instead
+        return pd.concat([self.value.iloc[position:position + 1] for position in positions])
@@ -0,0 +1,221 @@
+"""Precomputed aggregate snapshot for the browser (Pyodide) build of the dashboard.
+
+``python snapshot.py docs/app`` runs the aggregation ahead of time and writes a ``snapshot``
+directory next to the app: the frames the tabs display as typed arrays, the articles in pages
+that are only fetched when they are shown, and the modules main.py imports. The browser never
+downloads or parses the raw dataset.
+"""
+import functools
+import json
+import os
+import shutil
+import struct
+import sys
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from date_index import DateIndex
+from geo import GEO_ASSETS, MAP_PRECISION, load_geojson
+from paged_table import PagedTable
+
+SNAPSHOT_DIR = "snapshot"
+MANIFEST_FILE = "manifest.json"
+AGGREGATES_FILE = "aggregates.bin"
+
+# The store frames the tabs read, everything else is derived from them in the browser
+SNAPSHOT_FRAMES = ["summary", "occurrences_by_date", "topics", "box_stats", "outlier_raster", "smoothed_sentiment",
+                   "state_counts", "country_counts"]
+
+APP_MODULES = ["aggregates.py", "crossfilter.py", "dataset.py", "date_index.py", "downsample.py", "geo.py",
+               "ingest.py", "instrumentation.py", "locations.py", "paged_table.py", "snapshot.py", "topic_engine.py",
+               "update_scheduler.py", "wordclouds.py"]
+
+# Ten table pages per fetched article page
+ARTICLE_PAGE_SIZE = 250
+ARTICLE_PAGE_CACHE = 8
+
+ALIGNMENT = 8
+
+
+def encode_column(series):
+    # Layout of the column and the arrays holding it, every array is little-endian
+    values = series.to_numpy()
+    categorical = isinstance(series.dtype, pd.CategoricalDtype)
+    if categorical or (values.dtype == object and series.nunique() <= len(series) // 2):
+        # Repeated strings, like the topic of every daily sentiment row, are dictionary-encoded
+        column = series if categorical else series.astype("category")
+        layout = {"kind": "dictionary", "categories": column.cat.categories.astype(str).tolist(),
+                  "categorical": categorical}
+        return layout, [column.cat.codes.to_numpy().astype("<i4")]
+
+    if values.dtype.kind == "M":
+        return {"kind": "datetime"}, [values.astype("datetime64[ns]").view("<i8")]
+    if values.dtype.kind in "biuf":
+        dtype = values.dtype.newbyteorder("<")
+        return {"kind": "array", "dtype": dtype.str}, [values.astype(dtype)]
+
+    # Strings are stored as UTF-8 bytes with their end offsets, missing values are flagged separately
+    missing = series.isna().to_numpy()
+    encoded = [b"" if absent else str(value).encode() for value, absent in zip(values, missing)]
+    offsets = np.cumsum([len(value) for value in encoded], dtype="<i8")
+    return {"kind": "text"}, [offsets, missing.view(np.uint8), np.frombuffer(b"".join(encoded), dtype=np.uint8)]
+
+
+def decode_column(layout, buffers):
+    if layout["kind"] == "dictionary":
+        codes = np.frombuffer(buffers[0], dtype="<i4")
+        if layout["categorical"]:
+            return pd.Categorical.from_codes(codes, layout["categories"])
+        return np.append(np.array(layout["categories"], dtype=object), None)[codes]
+    if layout["kind"] == "datetime":
+        return np.frombuffer(buffers[0], dtype="<i8").view("datetime64[ns]")
+    if layout["kind"] == "array":
+        return np.frombuffer(buffers[0], dtype=layout["dtype"])
+
+    offsets = np.frombuffer(buffers[0], dtype="<i8")
+    missing = np.frombuffer(buffers[1], dtype=np.uint8).astype(bool)
+    starts = np.concatenate(([0], offsets[:-1]))
+    return np.array([None if absent else bytes(buffers[2][start:end]).decode()
+                     for start, end, absent in zip(starts, offsets, missing)], dtype=object)
+
+
+def write_frames(path, frames):
+    # A JSON header describing every column, followed by the aligned column arrays
+    header, arrays, position = {}, [], 0
+    for name, frame in frames.items():
+        columns = []
+        for column in frame.columns:
+            layout, column_arrays = encode_column(frame[column])
+            layout["name"], layout["buffers"] = column, []
+            for array in column_arrays:
+                layout["buffers"].append([position, array.nbytes])
+                arrays.append(array)
+                position += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+            columns.append(layout)
+        header[name] = {"rows": len(frame), "columns": columns}
+
+    encoded_header = json.dumps(header).encode()
+    encoded_header += b" " * (-(len(encoded_header) + 4) % ALIGNMENT)
+    with open(path, "wb") as file:
+        file.write(struct.pack("<I", len(encoded_header)) + encoded_header)
+        for array in arrays:
+            file.write(array.tobytes() + b"\0" * (-array.nbytes % ALIGNMENT))
+
+
+def read_frames(content):
+    # Columns are views onto the downloaded bytes, nothing is parsed except the text columns
+    header_length = struct.unpack_from("<I", content)[0]
+    header = json.loads(content[4:4 + header_length])
+    body = memoryview(content)[4 + header_length:]
+
+    frames = {}
+    for name, frame in header.items():
+        frames[name] = pd.DataFrame({
+            layout["name"]: decode_column(layout, [body[start:start + length] for start, length in layout["buffers"]])
+            for layout in frame["columns"]
+        }, index=pd.RangeIndex(frame["rows"]))
+    return frames
+
+
+def fetch(url):
+    # In the browser, Panel routes urllib through synchronous XHR requests
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+class ArticlePages:
+    def __init__(self, base_url, layout):
+        self.base_url = base_url
+        self.rows = layout["rows"]
+        self.page_size = layout["page_size"]
+        self.pages = layout["pages"]
+        self.schema = pd.DataFrame(columns=layout["columns"])
+        self.page = functools.lru_cache(maxsize=ARTICLE_PAGE_CACHE)(self._fetch_page)
+
+    def _fetch_page(self, index):
+        return read_frames(fetch(self.base_url + self.pages[index]))["articles"]
+
+    def rows_between(self, lo, hi):
+        hi = min(hi, self.rows)
+        if lo >= hi:
+            return self.schema
+        first, last = lo // self.page_size, (hi - 1) // self.page_size
+        rows = pd.concat([self.page(index) for index in range(first, last + 1)], ignore_index=True)
+        return rows.iloc[lo - first * self.page_size:hi - first * self.page_size]
+
+
+class ArticleTable(PagedTable):
+    # Without the full frame in the browser the articles are shown in dataset order
+    def __init__(self, articles, **params):
+        self._articles = articles
+        super().__init__(articles.schema, sortable=False, **params)
+
+    @property
+    def row_count(self):
+        return self._articles.rows
+
+    def _page_rows(self, lo, hi):
+        return self._articles.rows_between(lo, hi)
+
+
+class SnapshotStore:
+    # Read-only stand-in for the AggregateStore, loaded from an exported snapshot
+    def __init__(self, base_url):
+        manifest = json.loads(fetch(base_url + MANIFEST_FILE))
+        for name, frame in read_frames(fetch(base_url + manifest["aggregates"])).items():
+            setattr(self, name, frame)
+
+        self.version = manifest["version"]
+        self.date_index = DateIndex.from_frame(self.occurrences_by_date)
+        self.articles = ArticlePages(base_url, manifest["articles"])
+        self.listeners = []
+
+
+def export_snapshot(store, directory, page_size=ARTICLE_PAGE_SIZE):
+    snapshot_dir = os.path.join(directory, SNAPSHOT_DIR)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.makedirs(os.path.join(snapshot_dir, "articles"))
+    os.makedirs(os.path.join(snapshot_dir, "modules", "geodata"))
+
+    write_frames(os.path.join(snapshot_dir, AGGREGATES_FILE), {name: getattr(store, name) for name in SNAPSHOT_FRAMES})
+
+    pages = []
+    for page, start in enumerate(range(0, len(store.data), page_size)):
+        pages.append(f"articles/{page:05d}.bin")
+        write_frames(os.path.join(snapshot_dir, pages[-1]),
+                     {"articles": store.data.iloc[start:start + page_size].reset_index(drop=True)})
+
+    # The modules, and the GeoJSON files already simplified to the precision the maps use
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    modules = list(APP_MODULES)
+    for module in APP_MODULES:
+        shutil.copyfile(os.path.join(module_dir, module), os.path.join(snapshot_dir, "modules", module))
+    for name in GEO_ASSETS:
+        modules.append(f"geodata/{name}.json")
+        with open(os.path.join(snapshot_dir, "modules", modules[-1]), "w") as file:
+            json.dump(load_geojson(name, MAP_PRECISION), file, separators=(",", ":"))
+
+    # Written last, a browser never sees a manifest pointing at missing files
+    manifest = {
+        "version": store.version,
+        "aggregates": AGGREGATES_FILE,
+        "articles": {"rows": len(store.data), "page_size": page_size, "pages": pages,
+                     "columns": store.data.columns.tolist()},
+        "modules": modules,
+    }
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "w") as file:
+        json.dump(manifest, file, indent=1)
+    return snapshot_dir
+
+
+if __name__ == "__main__":
+    from aggregates import AggregateStore
+    from dataset import dataset_version, load_dataset
+
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.join("docs", "app")
+    store = AggregateStore(load_dataset(), dataset_version())
+    snapshot_dir = export_snapshot(store, target)
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(snapshot_dir) for name in names)
+    print(f"Snapshot of {len(store.data)} articles written to {snapshot_dir} ({size / 1e6:.1f} MB)")
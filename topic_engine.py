@@ -0,0 +1,159 @@
+"""Per-topic aggregation engine shared by the pie, bar, box and line charts.
+
+Every batch is partitioned by topic once. The partitions are split into row chunks and reduced on a
+worker pool into additive partials (count, sentiment sum, sentiment histogram, daily sums and
+counts), which are merged into one TopicTally per topic. The smoothed daily series run on the same
+pool, the outliers are counted from the sketches against the current quartiles. Set
+DASHBOARD_TOPIC_POOL to 'process' to use worker processes instead of threads, and
+DASHBOARD_TOPIC_WORKERS to size the pool (default: one per core).
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from downsample import raster_counts
+
+# Sentiment scores are polarities, the quantile sketches cover this range
+SENTIMENT_RANGE = (-1.0, 1.0)
+SKETCH_BINS = 2000
+SMOOTHING_WINDOW = 100
+
+# Outliers are drawn as one shaded cell per topic and sentiment bin instead of one point per article
+OUTLIER_BINS = 200
+
+TOPIC_POOL = os.environ.get("DASHBOARD_TOPIC_POOL", "thread")
+TOPIC_WORKERS = int(os.environ.get("DASHBOARD_TOPIC_WORKERS", 0)) or os.cpu_count() or 1
+
+# Partitions are split into chunks of this many rows, so a few large topics still make a task for every worker
+CHUNK_ROWS = 250_000
+
+NO_DAY = np.iinfo(np.int64).min
+
+
+class QuantileSketch:
+    # Fixed-width histogram over the sentiment range, quantiles are exact up to one bin width
+    def __init__(self, bins=SKETCH_BINS, value_range=SENTIMENT_RANGE):
+        self.edges = np.linspace(value_range[0], value_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        self.counts += raster_counts(values[~np.isnan(values)], len(self.counts), (self.edges[0], self.edges[-1]))
+
+    def quantiles(self, qs):
+        cumulative = np.cumsum(self.counts)
+        if cumulative[-1] == 0:
+            return np.full(len(qs), np.nan)
+
+        # Interpolate linearly inside the bin that contains each quantile
+        targets = np.asarray(qs) * cumulative[-1]
+        bins = np.minimum(np.searchsorted(cumulative, targets, side="left"), len(self.counts) - 1)
+        before = np.where(bins > 0, cumulative[bins - 1], 0)
+        fraction = np.divide(targets - before, self.counts[bins], out=np.zeros(len(bins)),
+                             where=self.counts[bins] > 0)
+        return self.edges[bins] + fraction * (self.edges[bins + 1] - self.edges[bins])
+
+    def outliers(self, lower, upper, bins=OUTLIER_BINS):
+        # The values of the sketch bins outside the whiskers, summed into the coarser outlier bins
+        centers = (self.edges[:-1] + self.edges[1:]) / 2
+        outside = (centers < lower) | (centers > upper)
+        return np.where(outside, self.counts, 0).reshape(bins, -1).sum(axis=1)
+
+
+class TopicPartial:
+    # Tallies of one chunk of one topic, every field adds up across chunks and batches
+    def __init__(self, scores, days):
+        valid = ~np.isnan(scores)
+        self.count = len(scores)
+        self.sentiment_sum = scores[valid].sum()
+
+        sketch = QuantileSketch()
+        sketch.add(scores)
+        self.histogram = sketch.counts
+
+        dated = valid & (days != NO_DAY)
+        self.days, positions = np.unique(days[dated], return_inverse=True)
+        self.day_sums = np.bincount(positions, weights=scores[dated], minlength=len(self.days))
+        self.day_counts = np.bincount(positions, minlength=len(self.days))
+
+
+class TopicTally:
+    def __init__(self):
+        self.count = 0
+        self.sentiment_sum = 0.0
+        self.sketch = QuantileSketch()
+        self.day_sums = pd.Series(dtype=float)
+        self.day_counts = pd.Series(dtype=np.int64)
+
+    def merge(self, partial):
+        self.count += partial.count
+        self.sentiment_sum += partial.sentiment_sum
+        self.sketch.counts += partial.histogram
+        self.day_sums = self.day_sums.add(pd.Series(partial.day_sums, index=partial.days), fill_value=0)
+        self.day_counts = self.day_counts.add(pd.Series(partial.day_counts, index=partial.days), fill_value=0)
+
+
+def partition_by_topic(batch):
+    # One stable sort of the topic codes makes every topic a contiguous slice of the batch
+    topics = batch['topic']
+    codes = topics.cat.codes.to_numpy()
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(topics.cat.categories) + 1))
+
+    scores = batch['sentiment_score'].to_numpy(dtype=float)[order]
+    days = batch['publication_day'].to_numpy().astype("datetime64[D]").astype(np.int64)[order]
+    return {str(topic): (scores[lo:hi], days[lo:hi])
+            for topic, lo, hi in zip(topics.cat.categories, bounds[:-1], bounds[1:]) if hi > lo}
+
+
+def chunks(values, size=CHUNK_ROWS):
+    return [values[start:start + size] for start in range(0, len(values), size)] or [values]
+
+
+def smooth_daily(topic, day_sums, day_counts):
+    # Average sentiment per publication day, smoothed over the neighbouring days with articles
+    means = (day_sums / day_counts).sort_index()
+    return pd.DataFrame({
+        'topic': topic,
+        'publication_date': means.index.to_numpy().astype("datetime64[D]").astype("datetime64[ns]"),
+        'sentiment_score': means.to_numpy(),
+        'smoothed_sentiment': means.rolling(window=SMOOTHING_WINDOW, center=True).mean().to_numpy(),
+    })
+
+
+class TopicEngine:
+    def __init__(self, pool=TOPIC_POOL, workers=TOPIC_WORKERS):
+        if workers <= 1:
+            self.executor = None
+        elif pool == "process":
+            # Spawned, forking the threads of a running server is not safe
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="topics")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def map(self, function, *iterables):
+        if self.executor is None:
+            return list(map(function, *iterables))
+        return list(self.executor.map(function, *iterables))
+
+    def accumulate(self, tallies, partitions):
+        # Reduce every chunk of every partition, then merge the partials into the topic tallies
+        tasks = [(topic, score_chunk, day_chunk) for topic, (scores, days) in partitions.items()
+                 for score_chunk, day_chunk in zip(chunks(scores), chunks(days))]
+        partials = self.map(TopicPartial, [task[1] for task in tasks], [task[2] for task in tasks])
+        for (topic, _, _), partial in zip(tasks, partials):
+            tallies.setdefault(topic, TopicTally()).merge(partial)
+
+    def smoothed_sentiment(self, tallies):
+        # Topics in name order, so equal dates keep a stable topic order after sorting by date
+        topics = sorted(tallies)
+        frames = self.map(smooth_daily, topics, [tallies[topic].day_sums for topic in topics],
+                          [tallies[topic].day_counts for topic in topics])
+        return pd.concat(frames, ignore_index=True).sort_values('publication_date', kind="stable", ignore_index=True)
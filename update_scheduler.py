@@ -0,0 +1,65 @@
+"""Coalesced updates of views driven by widgets that fire many events, like a dragged slider.
+
+A burst of values is reduced to the latest one, at most once per animation frame. It is computed on
+a worker thread and applied to the session's document in one batched change, unless a newer value
+arrived in the meantime: then the stale result is dropped and the newest value computed instead.
+"""
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from panel.io.model import hold
+from panel.io.state import set_curdoc
+
+# Milliseconds, 60 updates per second
+FRAME_INTERVAL = 16
+
+# Shared by the sessions of the process, the browser build has no threads
+EXECUTOR = None if sys.platform == "emscripten" else ThreadPoolExecutor(thread_name_prefix="updates")
+
+
+class UpdateScheduler:
+    # compute(value) runs off the event loop and must not touch the document, apply(result) updates it.
+    # Every other method runs on the event loop.
+    def __init__(self, doc, compute, apply, interval=FRAME_INTERVAL):
+        self.doc = doc
+        self.compute = compute
+        self.apply = apply
+        self.interval = interval
+        self.generation = 0
+        self.value = None
+        self.scheduled = False
+        self.running = False
+
+    def submit(self, value):
+        self.generation += 1
+        self.value = value
+        if self.doc is None or EXECUTOR is None:
+            # Outside a server session, e.g. in scripts and the browser build, updates apply immediately
+            self.apply(self.compute(value))
+        elif not self.scheduled and not self.running:
+            self.scheduled = True
+            self.doc.add_timeout_callback(self._flush, self.interval)
+
+    def _flush(self):
+        # One computation at a time, values submitted meanwhile wait for it
+        self.scheduled = False
+        self.running = True
+        future = EXECUTOR.submit(self.compute, self.value)
+        future.add_done_callback(partial(self._schedule_apply, self.generation))
+
+    def _schedule_apply(self, generation, future):
+        # Called on the worker thread, adding a next tick callback is the thread-safe way back to the document
+        try:
+            self.doc.add_next_tick_callback(partial(self._apply, generation, future))
+        except RuntimeError:
+            pass  # the session ended while computing
+
+    def _apply(self, generation, future):
+        self.running = False
+        if generation != self.generation:
+            # A newer value arrived while computing, it is computed instead of sending a stale result
+            self._flush()
+            return
+        with set_curdoc(self.doc), hold(self.doc):
+            self.apply(future.result())
@@ -0,0 +1,221 @@
+"""Wordclouds rendered on the server for any topic and publication date range.
+
+The article text is tokenized once, chunk by chunk, into term counts per topic and publication
+month. Every (topic, month) bucket keeps only its most frequent terms, so the counts stay small
+whatever the dataset size. The counting runs in the worker processes that render the images, never
+on the server event loop: the workers read the loaded dataset from its memory-mapped cache rather
+than receiving its text, and save its counts next to the cache, so other server workers and later
+starts load them instead. Rendered images are kept in a process-wide LRU cache keyed by the
+selection. Without the optional wordcloud package the static images of the wordclouds directory are
+shown instead.
+"""
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from dataset import (cache_paths, feather, normalize_dataset, read_cache_meta, read_dataset, read_records,
+                     write_cache_meta)
+
+try:
+    from wordcloud import STOPWORDS, WordCloud
+except ImportError:  # optional, e.g. the Pyodide build
+    STOPWORDS = frozenset()
+    WordCloud = None
+
+WORDCLOUD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordclouds")
+WORDCLOUD_URL = ("https://raw.githubusercontent.com/Rombeii/CNN-news-dashboard/"
+                 "9173f4f2f1a1a558c5b2d3c2544091a9b974e930/wordclouds/wordcloud_{topic}.png")
+STATIC_TOPICS = ["business", "entertainment", "politics", "sport", "tech"]
+
+TOKEN_PATTERN = r"[a-z][a-z']+"
+CHUNK_ROWS = 20_000
+TERMS_PER_BUCKET = 300
+CLOUD_WORDS = 150
+CLOUD_SIZE = (800, 400)
+
+# Articles without a publication date are only part of the clouds over the whole date range
+UNDATED = -1
+
+CACHE_SIZE = 64
+# Bump whenever count_terms or merge_counts change, so saved term counts are rebuilt
+TERMS_VERSION = 1
+TERMS_SUFFIX = ".terms.arrow"
+RENDER_WORKERS = int(os.environ.get("DASHBOARD_WORDCLOUD_WORKERS", 2))
+
+
+def static_wordcloud(topic):
+    # The images committed with the app, downloaded only when they are missing
+    path = os.path.join(WORDCLOUD_DIR, f"wordcloud_{topic}.png")
+    return path if os.path.exists(path) else WORDCLOUD_URL.format(topic=topic)
+
+
+def month_codes(days):
+    # Months since 1970, UNDATED for articles without a publication date
+    months = days.to_numpy().astype("datetime64[M]")
+    return np.where(np.isnat(months), UNDATED, months.astype(np.int64)).astype(np.int32)
+
+
+def count_terms(chunk):
+    # Term counts per topic and month of one chunk of articles
+    tokens = chunk['article'].fillna('').str.lower().str.findall(TOKEN_PATTERN)
+    lengths = tokens.str.len().to_numpy()
+    terms = pd.Series(np.fromiter(chain.from_iterable(tokens), dtype=object, count=lengths.sum()))
+
+    counts = pd.DataFrame({
+        'topic': np.repeat(chunk['topic'].astype(str).to_numpy(), lengths),
+        'month': np.repeat(month_codes(chunk['publication_day']), lengths),
+        'term': terms,
+    })[(terms.str.len() > 2) & ~terms.isin(STOPWORDS)]
+    return counts.value_counts().rename('count').reset_index()
+
+
+def merge_counts(tables):
+    # Sum the counts of equal keys and keep the most frequent terms of every (topic, month) bucket
+    table = pd.concat(tables, ignore_index=True).groupby(['topic', 'month', 'term'], sort=False)['count'].sum()
+    table = table.sort_values(ascending=False, kind="stable")
+    table = table.groupby(level=['topic', 'month']).head(TERMS_PER_BUCKET)
+
+    # Dictionary-encoded and sorted by topic and month, the compact form the queries read
+    table = table.reset_index().sort_values(['topic', 'month'], kind="stable", ignore_index=True)
+    return table.astype({'topic': 'category', 'term': 'category', 'month': np.int32, 'count': np.int32})
+
+
+def empty_terms():
+    return pd.DataFrame({'topic': pd.Categorical([]), 'month': np.array([], dtype=np.int32),
+                         'term': pd.Categorical([]), 'count': np.array([], dtype=np.int32)})
+
+
+def add_terms(table, chunk):
+    # Runs in a worker process
+    return merge_counts([table, count_terms(chunk)])
+
+
+def term_columns(chunk):
+    # The columns count_terms reads, as plain arrays: sliced Arrow arrays would be pickled with their whole buffers
+    return pd.DataFrame({'article': chunk['article'].to_numpy(dtype=object), 'topic': chunk['topic'].to_numpy(),
+                         'publication_day': chunk['publication_day'].to_numpy()})
+
+
+def count_dataset_terms(csv_file, end):
+    # Runs in a worker process: the term counts of the dataset records up to end, the rows a store was loaded
+    # with. They are read from the file and its memory-mapped cache instead of being sent over.
+    data, loaded_end = read_dataset(csv_file)
+    if loaded_end != end:
+        # Records were appended since the store was loaded, they are counted as it ingests them
+        data = normalize_dataset(read_records(csv_file, end))
+
+    meta = read_cache_meta(cache_paths(csv_file)[1]) if feather is not None and loaded_end == end else None
+    key = None if meta is None else {"version": TERMS_VERSION, "sha256": meta["sha256"], "end": end}
+    root, _ = os.path.splitext(csv_file)
+    terms_file, terms_meta_file = root + TERMS_SUFFIX, root + TERMS_SUFFIX + ".json"
+    if key is not None and read_cache_meta(terms_meta_file) == key:
+        return feather.read_feather(terms_file), len(data)
+
+    table = empty_terms()
+    for start in range(0, len(data), CHUNK_ROWS):
+        table = add_terms(table, data.iloc[start:start + CHUNK_ROWS])
+
+    if key is not None:
+        tmp_file = f"{terms_file}.{os.getpid()}.tmp"
+        feather.write_feather(table, tmp_file, compression="uncompressed")
+        os.replace(tmp_file, terms_file)
+        write_cache_meta(terms_meta_file, key)
+    return table, len(data)
+
+
+class TermIndex:
+    def __init__(self):
+        self.rows = 0
+        self.revision = 0
+        self.table = empty_terms()
+
+    def extend(self, table, rows):
+        # The counts of the first rows of the dataset, which only grows by appending
+        self.table, self.rows, self.revision = table, rows, self.revision + 1
+
+    def frequencies(self, topic, months=None, words=CLOUD_WORDS):
+        table = self.table
+        selected = (table['topic'] == topic).to_numpy()
+        if months is not None:
+            selected &= (table['month'] >= months[0]).to_numpy() & (table['month'] <= months[1]).to_numpy()
+        counts = table[selected].groupby('term', observed=True)['count'].sum().nlargest(words)
+        return {str(term): int(count) for term, count in counts.items()}
+
+
+def render_wordcloud(frequencies, size=CLOUD_SIZE):
+    # Runs in a worker process, returns the PNG bytes or None when nothing matched the selection
+    if not frequencies:
+        return None
+    cloud = WordCloud(width=size[0], height=size[1], background_color="white", random_state=0)
+    buffer = io.BytesIO()
+    cloud.generate_from_frequencies(frequencies).to_image().save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class WordcloudService:
+    def __init__(self, source=None, workers=RENDER_WORKERS, cache_size=CACHE_SIZE):
+        # The (csv_file, records end) the store was loaded from, see AggregateStore
+        self.source = source
+        self.index = TermIndex()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.closed = False
+
+        # Index updates run one at a time, they and the renders run in spawned worker processes
+        self.index_lock = asyncio.Lock()
+        self.render_executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _render(self, key, months):
+        # Requests for a selection that is already rendering share the pending render
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            future = self.render_executor.submit(render_wordcloud, self.index.frequencies(key[0], months))
+            future.add_done_callback(lambda done: done.exception() and self._evict(key))
+            self.cache[key] = future
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            return future
+
+    def _evict(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def close(self):
+        # Called when a newer dataset version replaces the service, its worker processes exit
+        self.closed = True
+        self.render_executor.shutdown(wait=False, cancel_futures=True)
+
+    async def update_index(self, data):
+        async with self.index_lock:
+            if self.index.rows == 0 and self.source is not None:
+                table, rows = await asyncio.wrap_future(self.render_executor.submit(count_dataset_terms,
+                                                                                    *self.source))
+                self.index.extend(table, rows)
+
+            # Only the articles ingested since the load are sent over, in chunks
+            for start in range(self.index.rows, len(data), CHUNK_ROWS):
+                chunk = term_columns(data.iloc[start:start + CHUNK_ROWS])
+                table = await asyncio.wrap_future(self.render_executor.submit(add_terms, self.index.table, chunk))
+                self.index.extend(table, start + len(chunk))
+
+    async def wordcloud(self, data, topic, months=None):
+        await self.update_index(data)
+        key = (topic, months, self.index.revision)
+        return await asyncio.wrap_future(self._render(key, months))
+
+
+def load_wordclouds(version, source=None):
+    # One service per process and dataset version, shared by every session
+    return WordcloudService(source)